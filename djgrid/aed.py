@@ -19,6 +19,7 @@ Parameters:
     - url_edit:string or None - redirect after editing
     - url_add:string or None - redirect after adding
     - url_delete:string or None - redirect after deleting
+    - model:django.db.models.Model or None - model class, if None then model is found by app_name and model_name
 
 Methods:
     - add_(a/e/d)_callback(function) - add a callback to do something with object after adding,editing or before deleting
@@ -86,7 +87,7 @@ from django.core.exceptions import ImproperlyConfigured
 from django.contrib import messages
 
 class AED(object):
-    def __init__(self,request,app_name,model_name,template_name,form_class,id=None,extra_initial = {},extra_context = {},force_ajax=False, action = None, url_add = None, url_edit = None, url_delete = None):
+    def __init__(self,request,app_name,model_name,template_name,form_class,id=None,extra_initial = {},extra_context = {},force_ajax=False, action = None, url_add = None, url_edit = None, url_delete = None, model = None):
         self.request = request
         self.app_name = app_name
         self.model_name = model_name
@@ -100,7 +101,7 @@ class AED(object):
         self.url_edit = url_edit
         self.url_delete = url_delete
         self.is_ajax = self.check_ajax(force_ajax)
-        self.model = get_model(self.app_name,self.model_name)
+        self.model = model or get_model(self.app_name,self.model_name)
         self.obj = self.get_object()
         self.form = None
         self.e_callbacks = []
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of grid data pipeline.
+
+Synthetic models are created in in-memory SQLite database, so benchmark is
+reproducible and does not need project settings:
+
+    python -m djgrid.benchmark.run --rows 20000 --repeat 5
+
+Every scenario reports number of queries, wall time, peak memory and rows
+per second. Results are compared with baseline saved by previous run.
+"""
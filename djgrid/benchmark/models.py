@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic models of benchmark
+"""
+from django.db import models
+
+
+class Supplier(models.Model):
+    name = models.CharField(max_length = 100)
+
+    def __unicode__(self):
+        return self.name
+
+
+class Category(models.Model):
+    title = models.CharField(max_length = 100)
+
+    def __unicode__(self):
+        return self.title
+
+
+class Region(models.Model):
+    name = models.CharField(max_length = 100)
+
+    def __unicode__(self):
+        return self.name
+
+
+class Owner(models.Model):
+    username = models.CharField(max_length = 100)
+
+    def __unicode__(self):
+        return self.username
+
+
+class Item(models.Model):
+    name = models.CharField(max_length = 100, db_index = True)
+    code = models.CharField(max_length = 20)
+    description = models.TextField()
+    note = models.TextField(blank = True)
+    price = models.DecimalField(max_digits = 10, decimal_places = 2)
+    quantity = models.IntegerField(db_index = True)
+    weight = models.FloatField()
+    rating = models.SmallIntegerField()
+    active = models.BooleanField()
+    created = models.DateTimeField()
+    day = models.DateField()
+    supplier = models.ForeignKey(Supplier)
+    category = models.ForeignKey(Category)
+    region = models.ForeignKey(Region)
+    owner = models.ForeignKey(Owner)
+
+    def __unicode__(self):
+        return self.name
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Runs grid benchmark scenarios and compares them with saved baseline.
+
+    python -m djgrid.benchmark.run [--rows 20000] [--repeat 5]
+        [--baseline gridbench.json] [--no-save] [--threshold 20]
+        [scenario ...]
+
+Every scenario runs in forked process (when available), so that its peak
+memory and database changes do not affect other scenarios. Exit status is
+1 when scenario got slower than threshold percent or makes more queries
+than baseline.
+"""
+import os
+import gc
+import sys
+import time
+import random
+import optparse
+import traceback
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+try:
+    import resource as rusage
+except ImportError:
+    rusage = None
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(DEBUG = True,
+                       DATABASES = {'default':{'ENGINE':'django.db.backends.sqlite3',
+                                               'NAME':':memory:'}},
+                       INSTALLED_APPS = ['django.contrib.auth',
+                                         'django.contrib.contenttypes',
+                                         'djgrid',
+                                         'djgrid.benchmark'],
+                       ROOT_URLCONF = 'djgrid.benchmark.urls')
+
+from django.db import connection, reset_queries
+from django.utils import simplejson
+from django.core.management import call_command
+from django.test.client import RequestFactory
+from django.contrib.auth.models import User
+
+from djgrid.grid import Grid
+from djgrid.serializers import JSONSerializer
+from djgrid.benchmark.models import Supplier, Category, Region, Owner, Item
+from djgrid.benchmark.urls import resource
+
+
+NARROW_FIELDS = ['id', 'name', 'quantity']
+WIDE_FIELDS = [field.name for field in Item._meta.fields]
+FK_FIELDS = ['id', 'name', 'supplier', 'category', 'region', 'owner']
+DISPLAY = {'supplier':'name', 'category':'title', 'region':'name', 'owner':'username'}
+
+PAGE_ROWS = 50
+# sqlite allows 999 variables in statement
+BATCH_SIZE = 60
+
+
+def populate(rows, seed = 1):
+    """
+    creates synthetic rows, same seed gives same data
+    """
+    generator = random.Random(seed)
+    related = []
+    for model, field in ((Supplier, 'name'), (Category, 'title'), (Region, 'name'), (Owner, 'username')):
+        model.objects.bulk_create([model(**{field:'%s %d' % (model._meta.object_name.lower(), i)}) for i in range(50)])
+        related.append(list(model.objects.all()))
+    suppliers, categories, regions, owners = related
+
+    start = datetime(2012, 1, 1)
+    batch = []
+    for i in range(rows):
+        created = start+timedelta(minutes = generator.randint(0, 60*24*365))
+        batch.append(Item(name = 'item %06d' % generator.randint(0, rows),
+                          code = 'C%05d' % i,
+                          description = ' '.join(['word%d' % generator.randint(0, 500) for j in range(30)]),
+                          note = 'note %d' % i,
+                          price = Decimal(generator.randint(100, 100000))/100,
+                          quantity = generator.randint(0, 1000),
+                          weight = generator.random()*100,
+                          rating = generator.randint(1, 5),
+                          active = generator.random()>0.5,
+                          created = created,
+                          day = created.date(),
+                          supplier = generator.choice(suppliers),
+                          category = generator.choice(categories),
+                          region = generator.choice(regions),
+                          owner = generator.choice(owners)))
+        if len(batch)==BATCH_SIZE:
+            Item.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Item.objects.bulk_create(batch)
+    User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+
+
+def grid_request(fields, post = {}, description = {}, **kwargs):
+    """
+    returns listview rows of grid serialized to json
+    """
+    params = {'_page':'1', '_rows':str(PAGE_ROWS), '_sidx':'', '_sord':'desc'}
+    params.update(post)
+    grid = Grid(queryset = Item.objects.all(),
+                fields = fields,
+                post = params,
+                app_label = 'benchmark',
+                model_name = 'item',
+                model = Item,
+                description = {'item':description},
+                url_prefix = 'benchmark',
+                **kwargs)
+    result = grid.get_data()
+    JSONSerializer().dumps(result)
+    return result
+
+
+def grid_scenario(fields, post = {}, description = {}, **kwargs):
+    def setup(rows):
+        def run():
+            return len(grid_request(fields, post, description, **kwargs)['rows'])
+        return run
+    return setup
+
+
+def deep_page_scenario(description = {}):
+    def setup(rows):
+        page = max(1, rows/PAGE_ROWS-1)
+        post = {'_sidx':'quantity', '_page':str(page)}
+        if description.get('pagination')=='keyset':
+            # page before is read without timing to get its cursor
+            previous = grid_request(WIDE_FIELDS, dict(post, _page = str(page-1)), description)
+            post['_cursor'] = previous.get('cursor', '')
+        def run():
+            return len(grid_request(WIDE_FIELDS, post, description)['rows'])
+        return run
+    return setup
+
+
+def request(path, data):
+    request = RequestFactory().post(path, data)
+    request.user = User.objects.get(username = 'benchmark')
+    return request
+
+
+def check(response):
+    if response.status_code!=200 or simplejson.loads(response.content).get('status')!='ok':
+        raise RuntimeError('request failed: %s' % response.content[:200])
+
+
+def inline_scenario(setup_rows):
+    def setup(rows):
+        items = list(Item.objects.order_by('pk')[:setup_rows])
+        def run():
+            for item in items:
+                data = {'idprimarykey':item.pk, 'name':item.name+' x', 'code':item.code,
+                        'description':item.description, 'note':item.note, 'price':item.price,
+                        'quantity':item.quantity+1, 'weight':item.weight, 'rating':item.rating,
+                        'active':'on' if item.active else '', 'created':item.created.strftime('%Y-%m-%d %H:%M:%S'),
+                        'day':item.day.strftime('%Y-%m-%d')}
+                check(resource.inline(request('/', data), 'benchmark', 'benchmark', 'item'))
+            return len(items)
+        return run
+    return setup
+
+
+def bulk_inline_scenario(setup_rows):
+    def setup(rows):
+        items = list(Item.objects.order_by('pk').values('pk', 'quantity')[:setup_rows])
+        data = {'rows':simplejson.dumps([{'idprimarykey':item['pk'], 'quantity':item['quantity']+1} for item in items])}
+        def run():
+            check(resource.bulk_inline(request('/', data), 'benchmark', 'benchmark', 'item'))
+            return len(items)
+        return run
+    return setup
+
+
+SCENARIOS = [
+    ('narrow', grid_scenario(NARROW_FIELDS)),
+    ('wide', grid_scenario(WIDE_FIELDS)),
+    ('wide_readonly', grid_scenario(WIDE_FIELDS, inline = False, readonly = True)),
+    ('fk_heavy', grid_scenario(FK_FIELDS, description = {'projection':False})),
+    ('fk_heavy_projected', grid_scenario(FK_FIELDS, description = {'display':DISPLAY})),
+    ('deep_page_offset', deep_page_scenario()),
+    ('deep_page_keyset', deep_page_scenario({'pagination':'keyset'})),
+    ('count_unfiltered', grid_scenario(NARROW_FIELDS, post = {'_rows':'1'})),
+    ('count_filtered', grid_scenario(NARROW_FIELDS, post = {'_rows':'1', '_search':'true', 'name':'item 00', 'quantity':'100..600'})),
+    ('count_limited', grid_scenario(NARROW_FIELDS, post = {'_rows':'1'}, count_strategy = 'limited', count_threshold = 1000)),
+    ('totals', grid_scenario(NARROW_FIELDS, description = {'totals':{'price':'sum', 'weight':'avg', 'quantity':'max', 'rating':'min'}})),
+    ('inline_save', inline_scenario(20)),
+    ('bulk_inline_save', bulk_inline_scenario(200)),
+]
+
+
+def get_peak_memory():
+    """
+    returns peak resident memory of process in kilobytes
+    """
+    if rusage is None:
+        return 0
+    peak = rusage.getrusage(rusage.RUSAGE_SELF).ru_maxrss
+    # bytes on mac os
+    if sys.platform=='darwin':
+        peak /= 1024
+    return peak
+
+
+def measure(setup, rows, repeat):
+    """
+    returns statistics of scenario runs
+    """
+    times = []
+    queries = 0
+    count = 0
+    memory = get_peak_memory()
+    for i in range(repeat):
+        run = setup(rows)
+        gc.collect()
+        reset_queries()
+        start = time.time()
+        count = run()
+        times.append(time.time()-start)
+        queries = len(connection.queries)
+    times.sort()
+    return {'queries':queries,
+            'rows':count,
+            'best':times[0],
+            'median':times[len(times)/2],
+            'rows_per_second':count/times[0] if times[0] else 0,
+            'peak_memory_kb':get_peak_memory()-memory}
+
+
+def measure_isolated(setup, rows, repeat):
+    """
+    measures scenario in forked process
+    """
+    if not hasattr(os, 'fork'):
+        return measure(setup, rows, repeat)
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid==0:
+        os.close(read)
+        try:
+            os.write(write, simplejson.dumps(measure(setup, rows, repeat)))
+        except:
+            traceback.print_exc()
+        os._exit(0)
+    os.close(write)
+    chunks = []
+    while True:
+        chunk = os.read(read, 4096)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read)
+    os.waitpid(pid, 0)
+    if not chunks:
+        raise RuntimeError('scenario failed')
+    return simplejson.loads(''.join(chunks))
+
+
+def compare(name, result, baseline, threshold):
+    """
+    returns change of best time in percents and regression flag
+    """
+    if name not in baseline or not baseline[name]['best']:
+        return None, False
+    change = (result['best']-baseline[name]['best'])*100/baseline[name]['best']
+    regression = change>threshold or result['queries']>baseline[name]['queries']
+    return change, regression
+
+
+def main(argv = None):
+    parser = optparse.OptionParser(usage = '%prog [options] [scenario ...]')
+    parser.add_option('--rows', type = 'int', default = 20000, help = 'number of synthetic rows')
+    parser.add_option('--repeat', type = 'int', default = 5, help = 'runs of every scenario')
+    parser.add_option('--seed', type = 'int', default = 1, help = 'seed of synthetic data')
+    parser.add_option('--baseline', default = 'gridbench.json', help = 'baseline file')
+    parser.add_option('--no-save', action = 'store_true', default = False, help = 'do not save results as new baseline')
+    parser.add_option('--threshold', type = 'float', default = 20.0, help = 'allowed slowdown in percents')
+    options, names = parser.parse_args(argv)
+
+    scenarios = [(name, setup) for name, setup in SCENARIOS if not names or name in names]
+    if not scenarios:
+        parser.error('unknown scenario, available: %s' % ', '.join([name for name, setup in SCENARIOS]))
+
+    call_command('syncdb', interactive = False, verbosity = 0)
+    started = time.time()
+    populate(options.rows, options.seed)
+    print 'populated %d rows in %.1fs' % (options.rows, time.time()-started)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            saved = simplejson.load(f)
+        if saved.get('rows')==options.rows:
+            baseline = saved['scenarios']
+        else:
+            print 'baseline %s was made with %s rows, it is not compared' % (options.baseline, saved.get('rows'))
+
+    print '%-20s %8s %6s %10s %10s %12s %10s %8s' % ('scenario', 'queries', 'rows', 'best ms', 'median ms', 'rows/s', 'peak kb', 'change')
+    results = {}
+    regressions = []
+    for name, setup in scenarios:
+        result = results[name] = measure_isolated(setup, options.rows, options.repeat)
+        change, regression = compare(name, result, baseline, options.threshold)
+        if regression:
+            regressions.append(name)
+        print '%-20s %8d %6d %10.2f %10.2f %12.0f %10d %8s%s' % (name, result['queries'], result['rows'],
+                                                               result['best']*1000, result['median']*1000,
+                                                               result['rows_per_second'], result['peak_memory_kb'],
+                                                               '%+.1f%%' % change if change is not None else '-',
+                                                               ' !' if regression else '')
+
+    if not options.no_save:
+        with open(options.baseline, 'w') as f:
+            simplejson.dump({'rows':options.rows, 'scenarios':dict(baseline, **results)}, f, indent = 2, sort_keys = True)
+    if regressions:
+        print 'regressions: %s' % ', '.join(regressions)
+        return 1
+    return 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+from django.conf.urls.defaults import patterns, include, url
+
+from djgrid.resources import GridResource
+
+
+class BenchmarkResource(GridResource):
+    class Meta:
+        register = [['benchmark','item']]
+        prefix = 'benchmark'
+
+
+resource = BenchmarkResource()
+
+urlpatterns = patterns('',
+    url(r'^', include(resource.urls)),
+)
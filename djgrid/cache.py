@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Caches for listview json responses.
+
+Responses are keyed by resource namespace, model generation and hash of
+normalized grid request parameters. Generation of model is changed on
+every save or delete of its instances (or instances of models displayed
+in its related columns), so stale responses are never served.
+
+Using:
+
+    from djgrid.cache import LocMemGridCache
+    class Resource(GridResource):
+        class Meta:
+            register = [['blog','post']]
+            cache = LocMemGridCache(timeout = 60, max_entries = 500)
+
+LocMemGridCache keeps responses in process memory, so invalidation is
+seen only by current process. Use DjangoGridCache with shared cache
+backend (memcached, redis) when several processes serve the grid.
+"""
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.db.models import signals
+from django.utils.encoding import smart_str
+
+
+class GridCache(object):
+    """
+    base class of listview response cache
+    """
+    # request parameters which do not change the response
+    IGNORED_PARAMS = ['csrfmiddlewaretoken', 'nd', 'initial']
+
+    def __init__(self, timeout = 300):
+        self.timeout = timeout
+        # signals hold receivers weakly, so handlers are kept here
+        self.handlers = []
+
+    def get_label(self, model):
+        return '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+    def make_key(self, namespace, model, params):
+        """
+        returns cache key of normalized request parameters
+        """
+        items = []
+        for key in sorted(params.keys()):
+            if key in self.IGNORED_PARAMS:
+                continue
+            items.append((key, params.getlist(key) if hasattr(params, 'getlist') else params[key]))
+        digest = hashlib.md5(smart_str(repr(items))).hexdigest()
+        label = self.get_label(model)
+        return 'djgrid:%s:%s:%s:%s' % (namespace, label, self.get_generation(label), digest)
+
+    def get(self, namespace, model, params):
+        return self.get_value(self.make_key(namespace, model, params))
+
+    def set(self, namespace, model, params, value):
+        self.set_value(self.make_key(namespace, model, params), value)
+
+    def invalidate(self, model):
+        """
+        makes all cached responses of model stale
+        """
+        self.new_generation(self.get_label(model))
+
+    def watch(self, model, dependencies = []):
+        """
+        invalidates model responses when model or one of its dependencies
+        (e.g. models of related columns) is saved or deleted
+        """
+        def handler(sender, **kwargs):
+            self.invalidate(model)
+        self.handlers.append(handler)
+        for sender in [model]+list(dependencies):
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(handler, sender = sender, dispatch_uid = 'djgrid-cache-%s-%s-%s' % (id(self), self.get_label(model), self.get_label(sender)))
+
+    def get_generation(self, label):
+        raise NotImplementedError
+
+    def new_generation(self, label):
+        raise NotImplementedError
+
+    def get_value(self, key):
+        raise NotImplementedError
+
+    def set_value(self, key, value):
+        raise NotImplementedError
+
+
+class LocMemGridCache(GridCache):
+    """
+    in-process least recently used cache
+    """
+    def __init__(self, timeout = 300, max_entries = 1000):
+        super(LocMemGridCache, self).__init__(timeout = timeout)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get_generation(self, label):
+        return self.generations.get(label, 0)
+
+    def new_generation(self, label):
+        with self.lock:
+            self.generations[label] = self.generations.get(label, 0)+1
+
+    def get_value(self, key):
+        with self.lock:
+            try:
+                expires, value = self.entries.pop(key)
+            except KeyError:
+                return None
+            if expires<time.time():
+                return None
+            # move entry to the end as most recently used
+            self.entries[key] = (expires, value)
+            return value
+
+    def set_value(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time()+self.timeout, value)
+            while len(self.entries)>self.max_entries:
+                self.entries.popitem(last = False)
+
+
+class DjangoGridCache(GridCache):
+    """
+    cache using django cache framework backend
+    """
+    def __init__(self, backend = 'default', timeout = 300):
+        super(DjangoGridCache, self).__init__(timeout = timeout)
+        self.backend = backend
+        self._cache = None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import get_cache
+            self._cache = get_cache(self.backend)
+        return self._cache
+
+    def get_generation(self, label):
+        return self.cache.get('djgrid:generation:%s' % label, 0)
+
+    def new_generation(self, label):
+        # unique generation can not match responses cached before it was
+        # set, it lives longer than responses cached with it
+        self.cache.set('djgrid:generation:%s' % label, uuid.uuid4().hex, self.timeout*2)
+
+    def get_value(self, key):
+        return self.cache.get(key)
+
+    def set_value(self, key, value):
+        self.cache.set(key, value, self.timeout)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export of filtered and ordered grid rows.
+
+Rows are read from database by chunks (see Grid.iterate) and written to
+response as soon as they are formatted, so memory used by export does not
+depend on number of exported rows.
+
+Formats:
+    - csv - comma separated values, utf-8
+    - jsonl - one json object per line
+    - xlsx - Excel workbook, requires XlsxWriter package, rows over sheet
+      limit continue on next sheet
+"""
+import os
+import csv
+import tempfile
+
+from django.utils import simplejson
+from django.utils.encoding import smart_str
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# rows of one Excel worksheet including header
+XLSX_MAX_ROWS = 1048576
+
+
+class Echo(object):
+    """
+    file-like object returning written value instead of buffering it
+    """
+    def write(self, value):
+        return value
+
+
+def iterate_cells(grid, chunk_size):
+    plan = grid.column_plan or grid.get_column_plan()
+    for item in grid.iterate(chunk_size = chunk_size):
+        yield plan.cells(item)
+
+
+def csv_export(grid, header, chunk_size = 1000):
+    writer = csv.writer(Echo())
+    yield writer.writerow([smart_str(name) for name in header])
+    for cells in iterate_cells(grid, chunk_size):
+        yield writer.writerow([smart_str(value) if value is not None else '' for value in cells])
+
+
+def jsonl_export(grid, header, chunk_size = 1000):
+    encoder = DjangoJSONEncoder()
+    for cells in iterate_cells(grid, chunk_size):
+        yield encoder.encode(dict(zip(grid.fields, cells)))+'\n'
+
+
+def xlsx_export(grid, header, chunk_size = 1000):
+    if xlsxwriter is None:
+        raise ImproperlyConfigured("XlsxWriter package is required for xlsx export")
+    return xlsx_chunks(grid, header, chunk_size)
+
+
+def xlsx_chunks(grid, header, chunk_size, buffer_size = 64*1024):
+    handle, path = tempfile.mkstemp(suffix = '.xlsx')
+    os.close(handle)
+    try:
+        # constant memory mode flushes every row to disk
+        workbook = xlsxwriter.Workbook(path, {'constant_memory':True})
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, header)
+        row = 1
+        for cells in iterate_cells(grid, chunk_size):
+            if row==XLSX_MAX_ROWS:
+                # rows past the limit would be silently dropped
+                worksheet = workbook.add_worksheet()
+                worksheet.write_row(0, 0, header)
+                row = 1
+            worksheet.write_row(row, 0, [value if isinstance(value, (int, long, float)) or value is None else unicode(value) for value in cells])
+            row += 1
+        workbook.close()
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(buffer_size)
+                if not data:
+                    break
+                yield data
+    finally:
+        os.remove(path)
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_export, 'text/csv; charset=utf-8'),
+    'jsonl': (jsonl_export, 'application/x-ndjson; charset=utf-8'),
+    'xlsx': (xlsx_export, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
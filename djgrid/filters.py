@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Filter planner for grid search values.
+
+Planner chooses lookup for every search value by field type and indexes
+declared on model, so that grid search could be satisfied by index scan:
+    - numbers, booleans and keys are compared by equality or range
+    - text is searched by prefix (case sensitive on indexed columns,
+      because case insensitive prefix can not use b-tree index)
+    - substring search (icontains) is used only when user asks for it
+
+Search value operators:
+    - ^value - starts with (default for text)
+    - =value - equals (default for numbers and keys)
+    - $value - ends with
+    - *value - contains
+    - >value, <value, >=value, <=value - comparison
+    - from..to - inclusive range
+
+Values which can not be casted to field type raise FilterError instead
+of being silently ignored.
+
+FilterCompiler compiles jqGrid advanced search filters (nested groups of
+rules) to one Q expression.
+"""
+import operator
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from django.utils import simplejson
+from django.db.models.fields import FieldDoesNotExist
+from django.utils.encoding import smart_unicode
+from django.core.exceptions import ValidationError
+
+
+class FilterError(ValueError):
+    """
+    search value can not be used to filter field
+    """
+    def __init__(self, field, value, message):
+        super(FilterError, self).__init__(message)
+        self.field = field
+        self.value = value
+        self.message = message
+
+
+class Lookup(object):
+    """
+    chosen lookup of search value
+    """
+    def __init__(self, field, lookup, value, indexed):
+        self.field = field
+        self.lookup = lookup
+        self.value = value
+        self.indexed = indexed
+
+    @property
+    def key(self):
+        return '%s__%s' % (self.field, self.lookup)
+
+    def as_q(self):
+        return Q(**{self.key:self.value})
+
+    def as_dict(self):
+        return {'field':self.field,
+                'lookup':self.lookup,
+                'value':smart_unicode(self.value),
+                'indexed':self.indexed}
+
+
+class FilterPlanner(object):
+    """
+    chooses lookups for search values of model fields
+    """
+    INTEGER_FIELDS = ['AutoField',
+                      'IntegerField',
+                      'SmallIntegerField',
+                      'PositiveIntegerField',
+                      'PositiveSmallIntegerField',
+                      'BigIntegerField']
+
+    BOOLEAN_FIELDS = ['BooleanField',
+                      'NullBooleanField']
+
+    RELATED_FIELDS = ['ForeignKey',
+                      'OneToOneField']
+
+    TEXT_FIELDS = ['CharField',
+                   'TextField',
+                   'EmailField',
+                   'SlugField',
+                   'URLField',
+                   'IPAddressField',
+                   'GenericIPAddressField',
+                   'FilePathField',
+                   'FileField',
+                   'ImageField',
+                   'XMLField']
+
+    # longest operators go first
+    COMPARISONS = [('>=', 'gte'),
+                   ('<=', 'lte'),
+                   ('>', 'gt'),
+                   ('<', 'lt'),
+                   ('=', 'exact')]
+
+    TEXT_OPERATORS = {'^':'startswith',
+                      '=':'exact',
+                      '$':'endswith',
+                      '*':'contains'}
+
+    RANGE_SEPARATOR = '..'
+
+    BOOLEAN_VALUES = {'1':True, 'true':True, 'yes':True, 'on':True,
+                      '0':False, 'false':False, 'no':False, 'off':False}
+
+    def __init__(self, model):
+        self.model = model
+        # model: names of its indexed fields
+        self.indexed = {}
+
+    def get_indexed_fields(self, model):
+        """
+        returns names of fields which lead an index of model
+        """
+        if model in self.indexed:
+            return self.indexed[model]
+        indexed = set()
+        for field_object in model._meta.fields:
+            if field_object.primary_key or field_object.unique or field_object.db_index:
+                indexed.add(field_object.name)
+        for together in getattr(model._meta, 'unique_together', []):
+            if together:
+                indexed.add(together[0])
+        for together in getattr(model._meta, 'index_together', []):
+            if together:
+                indexed.add(together[0])
+        for index in getattr(model._meta, 'indexes', []):
+            if index.fields:
+                indexed.add(index.fields[0].lstrip('-'))
+        self.indexed[model] = indexed
+        return indexed
+
+    def resolve(self, path):
+        """
+        returns field object and its index flag for field name or
+        path across relations, e.g. 'author__username'
+        """
+        model = self.model
+        names = path.split('__')
+        for name in names[:-1]:
+            field_object = model._meta.get_field(name)
+            model = field_object.rel.to
+        field_object = model._meta.get_field(names[-1], many_to_many = False)
+        return field_object, field_object.name in self.get_indexed_fields(model)
+
+    def cast(self, field_object, value):
+        """
+        returns value casted to python type of field
+        """
+        field_type = field_object.__class__.__name__
+        value = value.strip()
+        try:
+            if field_type in self.INTEGER_FIELDS:
+                return int(value)
+            elif field_type=='FloatField':
+                return float(value)
+            elif field_type=='DecimalField':
+                return Decimal(value)
+            elif field_type in self.BOOLEAN_FIELDS:
+                return self.BOOLEAN_VALUES[value.lower()]
+            elif field_type in self.RELATED_FIELDS:
+                return field_object.rel.to._meta.pk.to_python(value)
+            elif field_type in self.TEXT_FIELDS:
+                return smart_unicode(value)
+            return field_object.to_python(value)
+        except (ValueError, TypeError, KeyError, InvalidOperation, ValidationError):
+            raise FilterError(field_object.name, value, "'%s' is not a valid value for %s" % (value, field_object.verbose_name))
+
+    def plan(self, path, value, text_lookup = 'startswith'):
+        """
+        returns Lookup for search value of field, text without operator
+        is searched by text_lookup
+        """
+        try:
+            field_object, indexed = self.resolve(path)
+        except (FieldDoesNotExist, AttributeError):
+            raise FilterError(path, value, "unknown field %s" % path)
+        field_type = field_object.__class__.__name__
+
+        if field_type in self.TEXT_FIELDS:
+            if value[:1] in self.TEXT_OPERATORS:
+                lookup, value = self.TEXT_OPERATORS[value[:1]], value[1:]
+            else:
+                lookup = text_lookup
+            # only case sensitive exact and prefix lookups can use index
+            if lookup=='contains' or lookup=='endswith' or not indexed:
+                lookup = 'i'+lookup
+            return Lookup(path, lookup, self.cast(field_object, value), indexed)
+
+        if self.RANGE_SEPARATOR in value:
+            start, end = value.split(self.RANGE_SEPARATOR, 1)
+            return Lookup(path, 'range', (self.cast(field_object, start), self.cast(field_object, end)), indexed)
+        for prefix, lookup in self.COMPARISONS:
+            if value.startswith(prefix):
+                return Lookup(path, lookup, self.cast(field_object, value[len(prefix):]), indexed)
+        return Lookup(path, 'exact', self.cast(field_object, value), indexed)
+
+
+class FilterCompiler(object):
+    """
+    compiles jqGrid advanced search filters, e.g.
+        {"groupOp":"AND",
+         "rules":[{"field":"title","op":"bw","data":"django"}],
+         "groups":[{"groupOp":"OR","rules":[...]}]}
+    to Q expression. Compiled shapes of filters (groups, fields and
+    operators without values) are cached.
+    """
+    # jqGrid operator: lookup, negated
+    OPERATORS = {'eq':('exact', False),
+                 'ne':('exact', True),
+                 'lt':('lt', False),
+                 'le':('lte', False),
+                 'gt':('gt', False),
+                 'ge':('gte', False),
+                 'bw':('startswith', False),
+                 'bn':('startswith', True),
+                 'ew':('endswith', False),
+                 'en':('endswith', True),
+                 'cn':('contains', False),
+                 'nc':('contains', True),
+                 'in':('in', False),
+                 'ni':('in', True),
+                 'nu':('isnull', False),
+                 'nn':('isnull', True)}
+
+    TEXT_LOOKUPS = ['startswith', 'endswith', 'contains']
+
+    # day operators for date and datetime fields: bound of day and lookup
+    DAY_OPERATORS = {'lt':(0, 'lt'),
+                     'le':(1, 'lt'),
+                     'gt':(1, 'gte'),
+                     'ge':(0, 'gte')}
+
+    GROUP_OPERATORS = {'AND':operator.and_,
+                       'OR':operator.or_}
+
+    DATE_FIELDS = ['DateField',
+                   'DateTimeField']
+
+    MAX_DEPTH = 5
+
+    shapes = {}
+    SHAPES_LIMIT = 1000
+
+    def __init__(self, planner, fields, day_bounds = None):
+        """
+        day_bounds(field, value) returns start of day and start of next day
+        of date value, it is required to search date and datetime fields
+        """
+        self.planner = planner
+        self.fields = fields
+        self.day_bounds = day_bounds
+
+    def shape(self, group, values, depth = 0):
+        """
+        returns hashable shape of group and collects rule values
+        """
+        if not isinstance(group, dict) or depth>self.MAX_DEPTH:
+            raise FilterError('filters', group, "invalid filters")
+        rules = []
+        for rule in group.get('rules') or []:
+            if not isinstance(rule, dict):
+                raise FilterError('filters', rule, "invalid filters")
+            rules.append((rule.get('field'), rule.get('op')))
+            values.append(smart_unicode(rule.get('data', '')))
+        groups = tuple([self.shape(subgroup, values, depth+1) for subgroup in group.get('groups') or []])
+        return (group.get('groupOp', 'AND'), tuple(rules), groups)
+
+    def compile_shape(self, shape):
+        """
+        returns compiled group: operator, rules and compiled subgroups
+        """
+        group_op, rules, groups = shape
+        if group_op not in self.GROUP_OPERATORS:
+            raise FilterError('filters', group_op, "unknown group operator %s" % group_op)
+        compiled = []
+        for field, op in rules:
+            if field not in self.fields:
+                raise FilterError('filters', field, "unknown field %s" % field)
+            if op not in self.OPERATORS:
+                raise FilterError(field, op, "unknown operator %s" % op)
+            field_object, indexed = self.planner.resolve(field)
+            field_type = field_object.__class__.__name__
+            lookup, negated = self.OPERATORS[op]
+            if field_type in self.planner.TEXT_FIELDS and lookup in self.TEXT_LOOKUPS+['exact']:
+                # only case sensitive exact and prefix lookups can use index
+                if lookup in ('contains', 'endswith') or not indexed:
+                    lookup = 'i'+lookup
+            elif lookup in self.TEXT_LOOKUPS:
+                raise FilterError(field, op, "operator %s can not be used for %s" % (op, field_object.verbose_name))
+            compiled.append((field, field_object, field_type in self.DATE_FIELDS, op, lookup, negated))
+        return (self.GROUP_OPERATORS[group_op], compiled, [self.compile_shape(group) for group in groups])
+
+    def get_compiled(self, shape):
+        key = (self.planner.model, tuple(self.fields), shape)
+        try:
+            return FilterCompiler.shapes[key]
+        except KeyError:
+            pass
+        compiled = self.compile_shape(shape)
+        if len(FilterCompiler.shapes)>=self.SHAPES_LIMIT:
+            FilterCompiler.shapes.clear()
+        FilterCompiler.shapes[key] = compiled
+        return compiled
+
+    def rule(self, field, field_object, is_date, op, lookup, negated, value):
+        """
+        returns Q of rule with value casted to field type
+        """
+        if lookup=='isnull':
+            condition = Q(**{'%s__isnull' % field:True})
+        elif is_date and op not in ('nu', 'nn', 'in', 'ni'):
+            if self.day_bounds is None:
+                raise FilterError(field, value, "date search is not available")
+            bounds = self.day_bounds(field, value)
+            if op in self.DAY_OPERATORS:
+                index, lookup = self.DAY_OPERATORS[op]
+                condition = Q(**{'%s__%s' % (field, lookup):bounds[index]})
+            else:
+                condition = Q(**{'%s__gte' % field:bounds[0], '%s__lt' % field:bounds[1]})
+        elif lookup=='in':
+            values = [self.planner.cast(field_object, item) for item in value.split(',') if item.strip()]
+            condition = Q(**{'%s__in' % field:values})
+        else:
+            condition = Q(**{'%s__%s' % (field, lookup):self.planner.cast(field_object, value)})
+        return ~condition if negated else condition
+
+    def build(self, compiled, values):
+        group_op, rules, groups = compiled
+        conditions = []
+        for field, field_object, is_date, op, lookup, negated in rules:
+            conditions.append(self.rule(field, field_object, is_date, op, lookup, negated, values.next()))
+        for group in groups:
+            condition = self.build(group, values)
+            if condition is not None:
+                conditions.append(condition)
+        if not conditions:
+            return None
+        return reduce(group_op, conditions)
+
+    def compile(self, filters):
+        """
+        returns Q of filters json or None for empty filters
+        """
+        try:
+            filters = simplejson.loads(filters)
+        except ValueError:
+            raise FilterError('filters', filters, "invalid filters")
+        values = []
+        shape = self.shape(filters, values)
+        return self.build(self.get_compiled(shape), iter(values))
+
+
+planners = {}
+
+def get_planner(model):
+    """
+    returns planner of model, planners are created once per model
+    """
+    if model not in planners:
+        planners[model] = FilterPlanner(model)
+    return planners[model]
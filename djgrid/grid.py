@@ -1,11 +1,79 @@
 import time as tm
-import math, operator, traceback
-from datetime import datetime,date,time
+import sys, copy, math, operator, hashlib, base64, binascii, threading
+from datetime import datetime,date,time,timedelta
+from decimal import Decimal
 from django.core.urlresolvers import reverse
 from django.utils.safestring import mark_safe
-from django.db.models import get_model, Sum, Q
-from django.utils.encoding import smart_unicode
-from django.core.exceptions import ImproperlyConfigured
+from django.db.models import get_model, Sum, Avg, Min, Max, Count, Q
+from django.utils import simplejson
+from django.db import connections
+from django.core.cache import cache
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.db.models.query import EmptyQuerySet
+from django.utils.encoding import smart_unicode, smart_str, iri_to_uri
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist, ValidationError
+from django.conf import settings
+from django.utils import timezone
+from filters import FilterError, FilterCompiler, Lookup, get_planner
+from search import SearchBackend, SearchColumn, default_backend
+from instrumentation import Instrument
+
+def related_getter(name):
+    """
+    returns getter of related object which gives None for missing relation
+    """
+    def getter(item):
+        try:
+            return getattr(item, name)
+        except ObjectDoesNotExist:
+            return None
+    return getter
+
+
+def path_getter(path):
+    """
+    returns getter of field of related object given by path, e.g.
+    'author__name', which gives None for missing relation
+    """
+    names = path.split('__')
+    def getter(item):
+        for name in names:
+            try:
+                item = getattr(item, name)
+            except ObjectDoesNotExist:
+                return None
+            if item is None:
+                return None
+        return item
+    return getter
+
+
+class ColumnPlan(object):
+    """
+    precompiled getters and formatters of grid row cells. Projected plan
+    reads rows of values_list given by values instead of model instances
+    """
+    def __init__(self, pk_attname, columns, values = None, attnames = {}):
+        self.values = values
+        self.columns = columns
+        if values is None:
+            self.get_pk = operator.attrgetter(pk_attname)
+        else:
+            self.get_pk = operator.itemgetter(0)
+        self.attnames = attnames
+    
+    def cells(self, item):
+        return [formatter(getter(item)) for getter, formatter in self.columns]
+    
+    def get_attr(self, item, attname):
+        """
+        returns value of model field attribute of row
+        """
+        if self.values is None:
+            return getattr(item, attname)
+        return item[self.attnames[attname]]
+
 
 # Create your models here.
 class Grid(object):
@@ -14,6 +82,17 @@ class Grid(object):
     """
     UNDEFINED = 'undefined'
     
+    column_plans = {}
+    
+    MAX_WINDOW_PAGES = 10
+    
+    action_url_templates = {}
+    PK_PLACEHOLDER = '__pk__'
+    ACTION_PLACEHOLDER = '__action__'
+    
+    # alias of record count aggregated with totals
+    COUNT_ALIAS = 'djgrid_count'
+    
     INTEGER_FIELDS = ['IntegerField',
                       'SmallIntegerField',
                       'PositiveIntegerField',
@@ -26,6 +105,15 @@ class Grid(object):
     
     TOTAL_FIELDS = INTEGER_FIELDS+FLOAT_FIELDS
     
+    RELATED_FIELDS = ['ForeignKey',
+                      'OneToOneField']
+    
+    AGGREGATES = {'sum':Sum,
+                  'avg':Avg,
+                  'min':Min,
+                  'max':Max,
+                  'count':Count}
+    
     DATE_FIELDS = ['DateTimeField',
                    'DateField',
                    'TimeField']
@@ -62,6 +150,14 @@ class Grid(object):
                  date_format = "%d.%m.%Y",
                  time_format = "%H:%M",
                  url_prefix = 'jqgrid-admin',
+                 count_strategy = 'exact',
+                 count_timeout = 300,
+                 count_threshold = 10000,
+                 search_backend = None,
+                 compact = False,
+                 client_actions = False,
+                 instrument = False,
+                 parallel = False,
                  **kwargs):
         
         self.queryset = queryset
@@ -77,12 +173,22 @@ class Grid(object):
             self.limit = int(self.post['_rows'])
             self.sidx = self.post['_sidx']
             self.sord = self.post['_sord']
+            self.cursor = self.post.get('_cursor')
+            # virtual scroll requests window of several pages at once
+            self.npage = max(1, min(int(self.post.get('_npage') or 1), Grid.MAX_WINDOW_PAGES))
         except:
             raise ImproperlyConfigured("For grid render 'post' parameter should contain correct information about page, limit, sidx and sord") 
         
         self.count = None
+        self.aggregated_count = None
+        self.approximate = False
         self.total_pages = None
         self.start = None      
+        self.digest = None
+        self.errors = {}
+        self.plan = []
+        self.column_plan = None
+        self.rank_ordering = []
                         
         self.result = {}
         self.result['userdata'] = {}        
@@ -98,8 +204,11 @@ class Grid(object):
     
         self.inline = inline
         self.readonly = readonly
+        self.compact = compact
+        self.client_actions = client_actions
                 
         self.description = description
+        self.keyset = (self.get_directive('pagination')=='keyset')
         
         self.url_prefix = url_prefix
         
@@ -107,15 +216,27 @@ class Grid(object):
         self.date_format = date_format
         self.time_format = time_format
         
+        self.count_strategy = count_strategy
+        self.count_timeout = count_timeout
+        self.count_threshold = count_threshold
+        
+        self.search_backend = search_backend or default_backend
+        self.parallel = parallel
+        
+        # queries are counted only when instrumentation is requested
+        self.instrument = Instrument(self.queryset.db if instrument else None)
+        
     @classmethod    
-    def make_column_structure(cls, model, fields, safe = [], inline = True, readonly = False, app_label = None, model_name = None, **kwargs):
+    def make_column_structure(cls, model, fields, safe = [], inline = True, readonly = False, app_label = None, model_name = None, compact = False, action_url = None, **kwargs):
         """
-        constructs jqgrid colmodel and colnames to render the grid
+        constructs jqgrid colmodel and colnames to render the grid,
+        compact rows always start with primary key column. When url
+        template of actions is given, action links are made by client
         """
         colnames = []
         colmodel = []
         
-        if inline:
+        if inline or compact:
             pk_field = model._meta.pk.name
             colmodel.append({'name':pk_field+'primarykey',
                              'index':pk_field+'primarykey',
@@ -147,99 +268,259 @@ class Grid(object):
                              'width':100,
                              'formatter':'safe_formatter',
                              'align':'center',
-                             'sortable':False})
+                             'sortable':False,
+                             'search':False})
+            if action_url:
+                colmodel[-1]['formatter'] = 'action_links'
+                colmodel[-1]['formatoptions'] = {'url':action_url,
+                                                 'pk':Grid.PK_PLACEHOLDER,
+                                                 'action':Grid.ACTION_PLACEHOLDER}
             colnames.append('actions')      
         
         return (colmodel,colnames)       
     
-    def construct_search(self, field, value, field_type = 'CharField'):
-        if field_type in Grid.INTEGER_FIELDS:
-            modifier = int
-        elif field_type in Grid.FLOAT_FIELDS:
-            modifier = float
-        else:
-            modifier = smart_unicode
-        if value.startswith('^'):
-            return ("%s__istartswith" % field, modifier(value[1:]))
-        elif value.startswith('='):
-            return ("%s__iexact" % field, modifier(value[1:]))
-        elif value.startswith('$'):
-            return ("%s__iendswith" % field, modifier(value[1:]))
-        elif value.startswith('>'):
-            return ("%s__gt" % field, modifier(value[1:]))
-        elif value.startswith('<'):
-            return ("%s__lt" % field, modifier(value[1:]))
-        else:
-            return ("%s__icontains" % field, modifier(value))
- 
+    def construct_search(self, field, value, field_type = None):
+        """
+        returns lookup key and value chosen by filter planner, field_type
+        is ignored, type is taken from model field
+        """
+        lookup = get_planner(self.model).plan(field, value)
+        return (lookup.key, lookup.value)
+    
+    def plan_lookup(self, column, field, value):
+        """
+        returns planned lookup of search value, values which can not be
+        used for field are reported to client in 'errors'
+        """
+        try:
+            lookup = get_planner(self.model).plan(field, value)
+        except FilterError, e:
+            self.errors[column] = e.message
+            return None
+        self.plan.append(lookup)
+        return lookup
  
     def common_filter(self):
         """
         filter queryset
         """
-        filter_hash = {}
+        conditions = []
         for param in self.post:
             if param in self.fields and param not in self.exclude:
-                field_object = self.model._meta.get_field(param)
-                field_type = field_object.__class__.__name__
-                k,v = self.construct_search(param, self.post[param], field_type = field_type)
-                filter_hash[k]=v
-        print filter_hash
-        try:
-            self.queryset = self.queryset.filter(**filter_hash)
-        except:
-            traceback.print_exc()
+                lookup = self.plan_lookup(param, param, self.post[param])
+                if lookup is not None:
+                    conditions.append(lookup.as_q())
+        if conditions:
+            self.queryset = self.queryset.filter(*conditions)
         
         return True
     
     
+    def parse_date(self, value, format):
+        """
+        returns datetime of value in format
+        """
+        return datetime(*(tm.strptime(value, format)[0:6]))
+    
+    def date_lookups(self, field, value):
+        """
+        returns lookups of day or range of days 'from..to' (either end
+        can be omitted), range of days is half-open [from, day after to),
+        so that database can satisfy it by one index range scan
+        """
+        field_object, indexed = get_planner(self.model).resolve(field)
+        field_type = field_object.__class__.__name__
+        if '..' in value:
+            start, end = [part.strip() for part in value.split('..', 1)]
+        else:
+            start = end = value.strip()
+        if not start and not end:
+            raise FilterError(field, value, "'%s' is not a valid date" % value)
+        
+        try:
+            if field_type=='TimeField':
+                start = self.parse_date(start, self.time_format).time() if start else None
+                end = self.parse_date(end, self.time_format).time() if end else None
+                lookups = [('gte', start), ('lte', end)]
+            else:
+                start = self.parse_date(start, self.date_format) if start else None
+                end = self.parse_date(end, self.date_format)+timedelta(days = 1) if end else None
+                lookups = [('gte', start), ('lt', end)]
+        except ValueError:
+            raise FilterError(field, value, "'%s' is not a valid date" % value)
+        
+        result = []
+        for lookup, bound in lookups:
+            if bound is None:
+                continue
+            if field_type=='DateField':
+                bound = bound.date()
+            elif field_type=='DateTimeField' and getattr(settings, 'USE_TZ', False):
+                bound = timezone.make_aware(bound, timezone.get_current_timezone())
+            result.append(Lookup(field, lookup, bound, indexed))
+        return result
+    
     def date_filter(self, field, value):
         """
         filter queryset by date
         """
         try:
-            start = datetime.strptime(value, self.date_format)
-        except:
-            start = datetime(*(tm.strptime(value, self.date_format)[0:6])) 
-        try:      
-            finish = datetime.strptime(value+' 23:59:59',self.date_format+" %H:%M:%S")
-        except:
-            finish = datetime(*(tm.strptime(value+' 23:59:59', self.date_format+" %H:%M:%S")[0:6]))
-        
-        filter_hash = {field+'__gte':start,field+'__lte':finish}
-        
-        self.queryset = self.queryset.filter(**filter_hash)
+            lookups = self.date_lookups(field, value)
+        except FilterError, e:
+            self.errors[field] = e.message
+            return True
+        self.plan.extend(lookups)
+        self.queryset = self.queryset.filter(*[lookup.as_q() for lookup in lookups])
         
         return True
 
-    def related_filter(self, field, value):
+    def day_bounds(self, field, value):
+        """
+        returns start of day and start of next day of date value
+        """
+        if '..' in value:
+            raise FilterError(field, value, "'%s' is not a valid date" % value)
+        start, end = self.date_lookups(field, value)
+        return start.value, end.value
+    
+    def advanced_filter(self, filters):
+        """
+        filter queryset by jqGrid advanced search filters
+        """
+        compiler = FilterCompiler(get_planner(self.model), self.fields, day_bounds = self.day_bounds)
         try:
-            self.description[self.model_name]['search'][field]
-        except:
-            traceback.print_exc()
+            condition = compiler.compile(filters)
+        except FilterError, e:
+            self.errors['filters'] = e.message
+            return True
+        if condition is not None:
+            self.queryset = self.queryset.filter(condition)
+        
+        return True
+    
+    def global_filter(self, value):
+        """
+        filter queryset by value searched in every column listed in
+        'global_search' directive, columns which type can not hold the
+        value are skipped
+        """
+        column = self.get_directive('search_column')
+        fields = self.get_directive('global_search', self.fields)
+        if column:
+            self.queryset = SearchColumn(column, fields).search(self.queryset, value)
+            self.plan.append(Lookup(column, 'contains', value.lower(), False))
+            return True
+        
+        planner = get_planner(self.model)
+        search = self.get_directive('search', {})
+        conditions = []
+        for field in fields:
+            field_object, indexed = planner.resolve(field)
+            field_type = field_object.__class__.__name__
+            if field_type in planner.BOOLEAN_FIELDS:
+                continue
+            if field_type in Grid.DATE_FIELDS:
+                try:
+                    lookups = self.date_lookups(field, value)
+                except FilterError:
+                    continue
+                conditions.append(reduce(operator.and_, [lookup.as_q() for lookup in lookups]))
+                self.plan.extend(lookups)
+                continue
+            if field_type in Grid.RELATED_FIELDS:
+                related = search.get(field, [])
+                paths = ['%s__%s' % (field,f) for f in related]
+            else:
+                paths = [field]
+            for path in paths:
+                try:
+                    # global value is searched anywhere in text
+                    lookup = planner.plan(path, value, text_lookup = 'contains')
+                except FilterError:
+                    continue
+                conditions.append(lookup.as_q())
+                self.plan.append(lookup)
+        
+        if conditions:
+            self.queryset = self.queryset.filter(reduce(operator.or_, conditions))
         else:
-            orm_lookups = dict(self.construct_search('%s__%s' % (field,f),value) for f in self.description[self.model_name]['search'][field])
-            or_queries = [Q(**{k:v}) for k,v in orm_lookups.iteritems()]
-            self.queryset = self.queryset.filter(reduce(operator.or_, or_queries))
+            self.queryset = self.queryset.none()
+        
+        return True
+    
+    def related_filter(self, field, value):
+        """
+        filter queryset by fields of related object listed in 'search'
+        directive or by its primary key
+        """
+        search = self.get_directive('search', {}).get(field)
+        if not search:
+            lookup = self.plan_lookup(field, field, value)
+            if lookup is not None:
+                self.queryset = self.queryset.filter(lookup.as_q())
+            return True
+        
+        planner = get_planner(self.model)
+        lookups = []
+        errors = []
+        for f in search:
+            try:
+                lookups.append(planner.plan('%s__%s' % (field,f), value))
+            except FilterError, e:
+                errors.append(e.message)
+        if not lookups:
+            self.errors[field] = errors[0]
+            return True
+        self.plan.extend(lookups)
+        self.queryset = self.queryset.filter(reduce(operator.or_, [related.as_q() for related in lookups]))
 
         return True
             
+    def text_filter(self, field, value, backend):
+        """
+        filter queryset by search backend
+        """
+        if not isinstance(backend, SearchBackend):
+            backend = self.search_backend
+        self.queryset = backend.search(self.queryset, self.model._meta.get_field(field), value)
+        self.plan.append(Lookup(field, backend.lookup, value, backend.indexed))
+        
+        return True
+            
     def get_total_pages(self):
         """
         total amount of pages for this model
         """
         if self.count>0:
-            return int(math.ceil(self.count/self.limit))+1
+            return int(math.ceil(float(self.count)/self.limit))
         else:
             return 1
     
 
+    @classmethod
+    def get_action_url_template(cls, url_prefix, app_label, model_name):
+        """
+        returns url of object action with placeholders of primary key and
+        action, url is reversed once per model
+        """
+        key = (url_prefix, app_label, model_name)
+        try:
+            return Grid.action_url_templates[key]
+        except KeyError:
+            url = reverse('djgrid-actionview',kwargs={'prefix':url_prefix, 'app_label': app_label,'model_name': model_name,'object_id':Grid.PK_PLACEHOLDER, 'action':Grid.ACTION_PLACEHOLDER})
+            Grid.action_url_templates[key] = url
+            return url
+    
+    def get_action_url(self, instance_id, app_label, model_name, action):
+        url = Grid.get_action_url_template(self.url_prefix, app_label, model_name)
+        return url.replace(Grid.PK_PLACEHOLDER, iri_to_uri(smart_unicode(instance_id))).replace(Grid.ACTION_PLACEHOLDER, action)
+    
     def get_edit_url(self, instance_id, app_label, model_name):
-        return reverse('djgrid-actionview',kwargs={'prefix':self.url_prefix, 'app_label': app_label,'model_name': model_name,'object_id':instance_id, 'action':'edit'})
+        return self.get_action_url(instance_id, app_label, model_name, 'edit')
 
     
     def get_delete_url(self, instance_id, app_label, model_name):
-        return reverse('djgrid-actionview',kwargs={'prefix':self.url_prefix, 'app_label': app_label,'model_name': model_name,'object_id':instance_id,'action':'delete'})
+        return self.get_action_url(instance_id, app_label, model_name, 'delete')
     
     
     def get_action_urls(self,instance_id):
@@ -250,49 +531,167 @@ class Grid(object):
         delete_url = self.get_delete_url(instance_id, self.app_label, self.model_name)
         return mark_safe('<a href="%s" class="modal edit">Edit</a>&nbsp&nbsp<a href="%s" class="modal delete">Delete</a>' % (edit_url, delete_url,))
     
-    def analize(self, value, field_type, id):
-        if field_type=='DateTimeField':
-            try:
-                value = datetime.strftime(value,self.datetime_format)
-            except:
-                value = Grid.UNDEFINED
-        elif field_type=='DateField':
-            try:
-                value = datetime.strftime(value, self.date_format)
-            except:
-                value = Grid.UNDEFINED
-        elif field_type=='TimeField':
-            try:
-                value = datetime.strftime(value, self.time_format)
-            except:
-                value = Grid.UNDEFINED
-        elif field_type=='BooleanField':
-            if value==True:
-                value = 1
+    def make_formatter(self, field_type):
+        """
+        returns callable which converts raw field value for grid cell
+        """
+        if field_type in Grid.DATE_FIELDS:
+            if field_type=='DateTimeField':
+                format = self.datetime_format
+            elif field_type=='DateField':
+                format = self.date_format
             else:
-                value = 0
-        elif field_type in ['ForeignKey','OneToOneField']:
-            try:
-                value = '<a href="%s" title="%s">%s</a>' % (value.get_absolute_url(), smart_unicode(value) )
-            except:
-                value = smart_unicode(value)
+                format = self.time_format
+            def formatter(value):
+                try:
+                    return value.strftime(format)
+                except (AttributeError, ValueError):
+                    return Grid.UNDEFINED
+        elif field_type=='BooleanField':
+            def formatter(value):
+                return 1 if value==True else 0
+        elif field_type in Grid.RELATED_FIELDS:
+            formatter = smart_unicode
         elif field_type in ['FileField','ImageField']:
-            try:
-                value = value.name
-            except:
-                value = Grid.UNDEFINED          
-        return value
+            def formatter(value):
+                try:
+                    return value.name
+                except AttributeError:
+                    return Grid.UNDEFINED
+        else:
+            def formatter(value):
+                return value
+        return formatter
+
+    def analize(self, value, field_type, id):
+        return self.make_formatter(field_type)(value)
+
+    def make_column_plan(self):
+        """
+        resolves attribute and formatter for every grid field
+        """
+        columns = []
+        display = self.get_directive('display', {})
+        for field in self.fields:
+            field_object = self.model._meta.get_field(field)
+            field_type = field_object.__class__.__name__
+            if field_type in Grid.RELATED_FIELDS and field in display:
+                path = '%s__%s' % (field, display[field])
+                getter = path_getter(path)
+                field_type = get_planner(self.model).resolve(path)[0].__class__.__name__
+            elif field_type in Grid.RELATED_FIELDS:
+                getter = related_getter(field)
+            else:
+                getter = operator.attrgetter(field_object.attname)
+            columns.append((getter, self.make_formatter(field_type)))
+        return ColumnPlan(self.model._meta.pk.attname, columns)
+
+    def make_projection_plan(self):
+        """
+        resolves values_list paths and formatters for every grid field,
+        returns None when some column needs model instance
+        """
+        if not self.get_directive('projection', True) or self.get_directive('prefetch'):
+            return None
+        display = self.get_directive('display', {})
+        pk = self.model._meta.pk
+        values = [pk.attname]
+        attnames = {pk.attname:0}
+        columns = []
+        for field in self.fields:
+            field_object = self.model._meta.get_field(field)
+            field_type = field_object.__class__.__name__
+            if field_type in Grid.RELATED_FIELDS:
+                if field not in display:
+                    return None
+                path = '%s__%s' % (field, display[field])
+                field_type = get_planner(self.model).resolve(path)[0].__class__.__name__
+            else:
+                path = field_object.attname
+                attnames[path] = len(values)
+            if field_type in ['FileField','ImageField']:
+                # values_list gives file name
+                formatter = self.make_formatter(None)
+            else:
+                formatter = self.make_formatter(field_type)
+            columns.append((operator.itemgetter(len(values)), formatter))
+            values.append(path)
+        return ColumnPlan(pk.attname, columns, values = values, attnames = attnames)
+
+    def get_column_plan(self, projection = False):
+        """
+        returns column plan cached per model, fields, directives and formats
+        """
+        key = (self.model, tuple(self.fields), projection, repr(self.get_directive('display')),
+               repr(self.get_directive('projection')), repr(self.get_directive('prefetch')),
+               self.datetime_format, self.date_format, self.time_format)
+        try:
+            return Grid.column_plans[key]
+        except KeyError:
+            if projection:
+                plan = self.make_projection_plan()
+            else:
+                plan = self.make_column_plan()
+            Grid.column_plans[key] = plan
+            return plan
+
+    def get_directive(self, directive, default=None):
+        """
+        returns description directive for current model
+        """
+        try:
+            return self.description[self.model_name][directive]
+        except KeyError:
+            return default
+
+    def get_related_fields(self):
+        """
+        returns grid fields which are foreign keys or one-to-one relations
+        """
+        related = []
+        for field in self.fields:
+            if self.model._meta.get_field(field).__class__.__name__ in Grid.RELATED_FIELDS:
+                related.append(field)
+        return related
+
+    def select_related(self):
+        """
+        joins related objects displayed on grid to avoid query per cell,
+        relations that can not be joined are listed in 'prefetch' directive
+        """
+        related = self.get_related_fields()
+        if related:
+            self.queryset = self.queryset.select_related(*related)
+        prefetch = self.get_directive('prefetch', [])
+        if prefetch:
+            self.queryset = self.queryset.prefetch_related(*prefetch)
 
     def filter(self):
-        if not self.search:
-            return
+        value = self.post.get('_global', '').strip()
+        if value:
+            self.global_filter(value)
+        if self.search:
+            self.column_filter()
+            if self.post.get('filters'):
+                self.advanced_filter(self.post['filters'])
+        if self.errors:
+            self.queryset = self.queryset.none()
+            self.result['errors'] = self.errors
+        if settings.DEBUG:
+            self.result['plan'] = [lookup.as_dict() for lookup in self.plan]
+
+    def column_filter(self):
+        """
+        filter queryset by values of search toolbar
+        """
+        search = self.get_directive('search', {})
         for field in self.fields:
             if field in self.post:
                 field_object = self.model._meta.get_field(field)
                 field_type = field_object.__class__.__name__
                 value = self.post[field]
                 
-                if field_type in ['ForeignKey','OneToOneField']:
+                if field_type in Grid.RELATED_FIELDS:
                     self.exclude.append(field)
                     self.related_filter(field, value)
                     
@@ -300,69 +699,463 @@ class Grid(object):
                     self.exclude.append(field)
                     self.date_filter(field, value)
                     
+                elif search.get(field):
+                    self.exclude.append(field)
+                    self.text_filter(field, value, search[field])
+                    
         self.common_filter()
 
+    def project(self):
+        """
+        narrows queryset to values of displayed columns when no column
+        needs model instance, otherwise defers not displayed columns and
+        joins related objects, returns column plan of rows
+        """
+        field_object = self.keyset_field()
+        plan = self.get_column_plan(projection = True)
+        # values_list turns empty queryset of Django 1.4 into unfiltered one
+        if plan is not None and (field_object is None or field_object.attname in plan.attnames) and not self.queryset.query.extra_select \
+                and not isinstance(self.queryset, EmptyQuerySet):
+            self.queryset = self.queryset.values_list(*plan.values)
+        else:
+            names = [self.model._meta.pk.name]+list(self.fields)
+            if field_object is not None and field_object.name not in names:
+                names.append(field_object.name)
+            self.queryset = self.queryset.only(*names)
+            self.select_related()
+            plan = self.get_column_plan()
+        self.column_plan = plan
+        return plan
+    
+    def keyset_field(self):
+        """
+        returns not null concrete field used for keyset pagination or None
+        if grid is not keyset paginated or can not be sorted by cursor
+        """
+        # relevance of ranked search can not be sought by cursor
+        if not self.keyset or self.rank_ordering:
+            return None
+        if not self.sidx:
+            return self.model._meta.pk
+        try:
+            field_object = self.model._meta.get_field(self.sidx, many_to_many=False)
+        except FieldDoesNotExist:
+            return None
+        if field_object.null or field_object.rel:
+            return None
+        return field_object
+    
     def order(self):
+        # relevance of ranked search goes first, order_by would drop it
+        self.rank_ordering = list(self.queryset.query.extra_order_by)
+        ordering = list(self.rank_ordering)
         if self.sidx:
             if self.sord=='asc':    
-                self.queryset = self.queryset.order_by('-'+self.sidx)
+                ordering.append('-'+self.sidx)
             else:
-                self.queryset = self.queryset.order_by(self.sidx)
+                ordering.append(self.sidx)
+        # primary key makes keyset ordering unique
+        field_object = self.keyset_field()
+        if field_object is not None and not (self.sidx and field_object.primary_key):
+            ordering.append('-pk' if self.sord=='asc' else 'pk')
+        if ordering:
+            self.queryset = self.queryset.order_by(*ordering)
+    
+    def get_totals(self):
+        """
+        returns dict of field and aggregate function name to show in footer,
+        by default numeric fields are summed
+        """
+        totals = self.get_directive('totals')
+        if totals is None:
+            totals = []
+            for field in self.fields:
+                field_type = self.model._meta.get_field(field).__class__.__name__
+                if field_type in Grid.TOTAL_FIELDS and field_type!='BooleanField':
+                    totals.append(field)
+        if not isinstance(totals, dict):
+            totals = dict((field, 'sum') for field in totals)
+        return totals
     
     def aggregate(self):
-        for field in self.fields:
+        """
+        calculates all totals with one query, exact count of records
+        is calculated by the same query
+        """
+        aggregates = {}
+        if self.count_strategy=='exact' and not self.queryset.query.distinct:
+            aggregates[Grid.COUNT_ALIAS] = Count('pk')
+        for field, function in self.get_totals().iteritems():
             try:
-                if self.model._meta.get_field(field).__class__.__name__ in Grid.TOTAL_FIELDS:
-                    self.result['userdata'][field] = float(self.queryset.aggregate(Sum(field))[field+'__sum'])        
-            except:
-                pass
+                aggregate_class = Grid.AGGREGATES[function.lower()]
+            except KeyError:
+                raise ImproperlyConfigured("Unknown aggregate function '%s' for field '%s', use one of: %s" % (function, field, ', '.join(sorted(Grid.AGGREGATES))))
+            aggregates['%s__%s' % (field, function.lower())] = aggregate_class(field)
+        if not aggregates:
+            return
+        values = self.queryset.aggregate(**aggregates)
+        self.aggregated_count = values.pop(Grid.COUNT_ALIAS, None)
+        for alias, value in values.iteritems():
+            if value is None:
+                continue
+            field = alias.rsplit('__', 1)[0]
+            if isinstance(value, (int, long, float, Decimal)):
+                value = float(value)
+            else:
+                value = self.make_formatter(self.model._meta.get_field(field).__class__.__name__)(value)
+            self.result['userdata'][field] = value
+    
+    def get_query_digest(self, queryset=None):
+        """
+        returns digest of filtered and ordered query to bind cursor with
+        """
+        if queryset is None:
+            queryset = self.queryset
+        try:
+            return hashlib.md5(smart_str(queryset.query)).hexdigest()
+        except EmptyResultSet:
+            return None
+    
+    def estimate_count(self):
+        """
+        returns planner statistics estimate of table rows or None
+        if database does not provide it
+        """
+        connection = connections[self.queryset.db]
+        table = self.model._meta.db_table
+        if connection.vendor=='postgresql':
+            sql = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+            params = [connection.ops.quote_name(table)]
+        elif connection.vendor=='mysql':
+            sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+            params = [table]
+        else:
+            return None
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        if row is None or row[0] is None or row[0]<=0:
+            return None
+        return int(row[0])
+    
+    def get_count(self):
+        """
+        returns number of records and flag whether it is approximate
+        according to count strategy:
+            - exact - count query on every request
+            - estimate - planner statistics for unfiltered grid
+            - cached - count cached by filtered query for count_timeout seconds
+            - limited - do not count more than count_threshold records
+        """
+        # filter errors and global search without searchable columns make
+        # queryset empty, it has no where clause on Django 1.4
+        if self.errors or isinstance(self.queryset, EmptyQuerySet):
+            return 0, False
+        if self.count_strategy=='estimate':
+            if not self.queryset.query.where:
+                count = self.estimate_count()
+                if count is not None:
+                    return count, True
+        elif self.count_strategy=='cached':
+            digest = self.get_query_digest(self.queryset.order_by())
+            if digest is None:
+                return 0, False
+            key = 'djgrid-count-%s-%s' % (self.model._meta.db_table, digest)
+            count = cache.get(key)
+            if count is not None:
+                return count, True
+            count = self.queryset.count()
+            cache.set(key, count, self.count_timeout)
+            return count, False
+        elif self.count_strategy=='limited':
+            count = self.queryset[:self.count_threshold+1].count()
+            if count>self.count_threshold:
+                return self.count_threshold, True
+            return count, False
+        elif self.count_strategy!='exact':
+            raise ImproperlyConfigured("Unknown count strategy '%s', use one of: exact, estimate, cached, limited" % self.count_strategy)
+        elif self.aggregated_count is not None:
+            return self.aggregated_count, False
+        return self.queryset.count(), False
+    
+    def encode_cursor(self, items):
+        """
+        returns opaque cursor with sort values of first and last page rows
+        """
+        field_object = self.keyset_field()
+        if field_object is None or not items or self.digest is None:
+            return None
+        plan = self.column_plan or self.get_column_plan()
+        bounds = []
+        for item in (items[0], items[-1]):
+            value = plan.get_attr(item, field_object.attname)
+            if not isinstance(value, (int, long, float, bool)):
+                value = smart_unicode(value)
+            bounds.append([value, smart_unicode(plan.get_pk(item))])
+        cursor = {'page':self.page,
+                  'pages':self.npage,
+                  'rows':self.limit,
+                  'query':self.digest,
+                  'first':bounds[0],
+                  'last':bounds[1]}
+        return base64.urlsafe_b64encode(simplejson.dumps(cursor))
+    
+    def decode_cursor(self):
+        """
+        returns cursor sent by client if it was made for current query
+        """
+        field_object = self.keyset_field()
+        if field_object is None or not self.cursor or self.digest is None:
+            return None
+        try:
+            cursor = simplejson.loads(base64.urlsafe_b64decode(smart_str(self.cursor)))
+            if cursor['query']!=self.digest or cursor['rows']!=self.limit:
+                return None
+            for bound in (cursor['first'], cursor['last']):
+                bound[0] = field_object.to_python(bound[0])
+                bound[1] = self.model._meta.pk.to_python(bound[1])
+        except (TypeError, ValueError, KeyError, IndexError, binascii.Error, ValidationError):
+            return None
+        return cursor
+    
+    def seek_condition(self, value, pk, forward = True, inclusive = False):
+        """
+        returns condition of rows following (or preceding) row with given
+        sort column value and primary key in current ordering
+        """
+        if forward==(self.sord=='asc'):
+            lookup = 'lt'
+        else:
+            lookup = 'gt'
+        pk_lookup = 'pk__%s%s' % (lookup, 'e' if inclusive else '')
+        
+        field_object = self.keyset_field()
+        if field_object.primary_key:
+            return Q(**{pk_lookup:pk})
+        return Q(**{'%s__%s' % (field_object.name, lookup):value}) | Q(**{field_object.name:value, pk_lookup:pk})
+    
+    @property
+    def window(self):
+        """
+        number of rows in requested window of pages
+        """
+        return self.limit*self.npage
+    
+    def seek(self):
+        """
+        returns queryset narrowed to requested window continuing from cursor
+        position instead of scanning offset rows, or None if cursor can not
+        be used
+        """
+        cursor = self.decode_cursor()
+        if cursor is None:
+            return None
+        if self.page==cursor['page']+cursor.get('pages', 1):
+            (value, pk), forward, inclusive = cursor['last'], True, False
+        elif self.page==cursor['page']:
+            (value, pk), forward, inclusive = cursor['first'], True, True
+        elif self.page+self.npage==cursor['page']:
+            (value, pk), forward, inclusive = cursor['first'], False, False
+        else:
+            return None
+        
+        queryset = self.queryset.filter(self.seek_condition(value, pk, forward, inclusive))
+        if forward:
+            return queryset[:self.window]
+        return list(queryset.reverse()[:self.window])[::-1]
+    
+    def get_window(self):
+        """
+        returns queryset of requested window of rows
+        """
+        if self.keyset_field() is not None:
+            self.digest = self.get_query_digest()
+        queryset = self.seek()
+        if queryset is None:
+            queryset = self.queryset[self.start:self.start+self.window]
+        return queryset
     
     def paginate(self):
-        self.count = self.queryset.count()
+        self.count, self.approximate = self.get_count()
+        self.set_pages()
+        self.queryset = self.get_window()
+    
+    def set_pages(self):
+        """
+        sets number of pages and keeps requested page within them
+        """
         self.total_pages = self.get_total_pages()
-        if self.page>self.total_pages:
+        if self.approximate and self.count_strategy!='cached':
+            # estimated and limited counts can be lower than real one
+            self.total_pages = max(self.total_pages, self.page)
+        elif self.page>self.total_pages:
             self.page = self.total_pages
         self.start = self.limit*self.page-self.limit
-        
-        self.queryset = self.queryset[self.start:self.start+self.limit]    
         self.result['page']=self.page
         self.result['total']=self.total_pages
         self.result['records']=self.count
+        if self.approximate:
+            self.result['approximate']=True
+            if self.count_strategy=='limited':
+                # counted records are lower bound of real number
+                self.result['lower_bound']=True
     
-    def get_data(self):
-        # filtering
-        self.filter()
-        # ordering by sidx
-        self.order()
-        # aggregate total sum
-        self.aggregate()
-        # pagination operations   
-        self.paginate()
-        
-        self.result['rows']=[]
+    def adjust_pages(self, rows):
+        """
+        moves total of estimated or limited count past the fetched window
+        while it is full, so that user can page further, window which
+        comes back short ends the rows and gives their exact number
+        """
+        if not self.approximate or self.count_strategy=='cached':
+            return
+        if rows>=self.window:
+            self.total_pages = max(self.total_pages, self.page+self.npage)
+        elif rows:
+            self.total_pages = self.page+int(math.ceil(float(rows)/self.limit))-1
+            self.count, self.approximate = self.start+rows, False
+            self.result.pop('approximate', None)
+            self.result.pop('lower_bound', None)
+            self.result['records']=self.count
+        self.result['total']=self.total_pages
+    
+    def is_parallel(self):
+        """
+        parallel queries need separate connections to the same database,
+        every sqlite connection to in-memory database has its own one
+        """
+        return self.parallel and connections[self.queryset.db].vendor!='sqlite'
+    
+    def fetch_parallel(self, queryset):
+        """
+        returns rows of requested window fetched while totals and count
+        of filtered queryset (before projection) are calculated by other
+        thread with its own database connection, window is fetched again
+        if requested page is past the last one
+        """
+        failures = []
+        # copy shares result with grid, but not its projected queryset
+        counter = copy.copy(self)
+        counter.queryset = queryset
+        def count():
+            try:
+                counter.aggregate()
+                counter.count, counter.approximate = counter.get_count()
+            except:
+                failures.append(sys.exc_info())
+            finally:
+                connections[queryset.db].close()
         
-        pk_field = self.queryset.model._meta.pk.name
+        thread = threading.Thread(target = count)
+        thread.start()
+        page = self.page
+        self.start = self.limit*self.page-self.limit
+        try:
+            items = list(self.get_window())
+        finally:
+            thread.join()
+        if failures:
+            raise failures[0][0], failures[0][1], failures[0][2]
+        self.aggregated_count = counter.aggregated_count
+        self.count, self.approximate = counter.count, counter.approximate
         
-        for item in self.queryset:
-            row = {}
-            row['cell'] = []
-            
-            if self.inline:
-                row['cell'].append(getattr(item,pk_field))
-         
-            for index,field in enumerate(self.fields):
-                field_type = item._meta.get_field(field).__class__.__name__
-                pk = getattr(item,pk_field)
-                try:
-                    val = getattr(item,field)
-                except:
-                    val = None
-                value = self.analize(val, field_type, pk) 
-                row['cell'].append(value)
+        self.set_pages()
+        if self.page!=page:
+            items = list(self.get_window())
+        self.queryset = items
+        return items
+    
+    def iterate(self, chunk_size = 1000):
+        """
+        yields filtered and ordered model instances fetching them by chunks,
+        next chunk is sought from last row of previous one when ordering
+        allows keyset, otherwise it is sliced by offset
+        """
+        field_object = self.keyset_field()
+        plan = self.column_plan or self.get_column_plan()
+        queryset = self.queryset
+        if field_object is None:
+            # offset chunks need unique ordering, primary key breaks ties
+            ordering = list(queryset.query.order_by) or list(self.model._meta.ordering)
+            pk_name = self.model._meta.pk.name
+            if not set(ordering) & set(['pk', '-pk', pk_name, '-'+pk_name]):
+                queryset = queryset.order_by(*(ordering+['pk']))
+        offset = 0
+        last = None
+        while True:
+            if field_object is None:
+                chunk = list(queryset[offset:offset+chunk_size])
+                offset += chunk_size
+            elif last is None:
+                chunk = list(self.queryset[:chunk_size])
+            else:
+                condition = self.seek_condition(plan.get_attr(last, field_object.attname), plan.get_pk(last))
+                chunk = list(self.queryset.filter(condition)[:chunk_size])
+            for item in chunk:
+                yield item
+            if len(chunk)<chunk_size:
+                return
+            last = chunk[-1]
+    
+    def get_data(self):
+        with self.instrument:
+            # filtering
+            with self.instrument.stage('filter'):
+                self.filter()
+            # ordering by sidx
+            with self.instrument.stage('order'):
+                self.order()
+            if self.is_parallel():
+                # totals and count are calculated on model queryset
+                queryset = self.queryset
+                # read only displayed columns or join related objects
+                with self.instrument.stage('project'):
+                    plan = self.project()
+                # totals and count queries run in other thread
+                with self.instrument.stage('parallel') as stage:
+                    items = self.fetch_parallel(queryset)
+                    stage.rows = len(items)
+            else:
+                # aggregate totals
+                with self.instrument.stage('aggregate'):
+                    self.aggregate()
+                # read only displayed columns or join related objects
+                with self.instrument.stage('project'):
+                    plan = self.project()
+                # pagination operations   
+                with self.instrument.stage('paginate'):
+                    self.paginate()
+                
+                with self.instrument.stage('fetch') as stage:
+                    items = list(self.queryset)
+                    stage.rows = len(items)
+            self.adjust_pages(len(items))
             
-            if not self.readonly:
-                row['cell'].append(self.get_action_urls(pk))
-                 
-            self.result['rows'].append(row)
+            with self.instrument.stage('rows') as stage:
+                self.result['rows']=[]
+                
+                for item in items:
+                    pk = plan.get_pk(item)
+                    cell = plan.cells(item)
+                    
+                    if self.inline or self.compact:
+                        cell.insert(0, pk)
+                    
+                    if self.readonly:
+                        pass
+                    elif self.client_actions:
+                        # links are made by action_links formatter of client
+                        cell.append(pk)
+                    else:
+                        cell.append(self.get_action_urls(pk))
+                    
+                    if self.compact:
+                        self.result['rows'].append(cell)
+                    else:
+                        self.result['rows'].append({'id':pk,'cell':cell})
+                stage.rows = len(self.result['rows'])
+        
+        cursor = self.encode_cursor(items)
+        if cursor is not None:
+            self.result['cursor'] = cursor
             
-        return self.result
\ No newline at end of file
+        return self.result
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Timings and query counts of grid requests.
+
+Grid.get_data runs in stages (filter, order, aggregate, project, paginate,
+fetch, rows), listview adds serialize stage. When resource has sinks or
+timing payload, duration, number of SQL queries, SQL time and number of
+rows of every stage is recorded and sent to sinks:
+
+    from djgrid.instrumentation import LoggingSink, StatsdSink, ServerTimingSink
+    class Resource(GridResource):
+        class Meta:
+            register = [['blog','post']]
+            instrumentation = [LoggingSink(), StatsdSink(prefix = 'grids'), ServerTimingSink()]
+            timing_payload = True
+
+Queries are counted by debug cursor of connection, it is enabled only
+while grid data is fetched and queries logged by it are dropped afterwards
+unless DEBUG is on. Statements and their parameters are kept by stages,
+so that they can be explained by slow grid log.
+"""
+import time
+import socket
+import logging
+
+from django.conf import settings
+from django.db import connections
+
+
+class StatementCursor(object):
+    """
+    cursor wrapper recording executed statements with parameters
+    """
+    def __init__(self, cursor, statements):
+        self.cursor = cursor
+        self.statements = statements
+
+    def execute(self, sql, params = ()):
+        self.statements.append((sql, params))
+        return self.cursor.execute(sql, params)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class Stage(object):
+    """
+    duration, queries and rows of one stage of grid request
+    """
+    def __init__(self, name, instrument = None):
+        self.name = name
+        self.instrument = instrument
+        self.duration = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.rows = None
+        self.statements = []
+
+    def __enter__(self):
+        if self.instrument is not None:
+            self.first = self.instrument.query_count()
+            self.first_statement = len(self.instrument.statements)
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.time()-self.started
+        if self.instrument is not None:
+            queries = self.instrument.get_queries(self.first)
+            self.queries = len(queries)
+            self.sql_time = sum([float(query.get('time') or 0) for query in queries])
+            self.statements = self.instrument.statements[self.first_statement:]
+        return False
+
+    def as_dict(self):
+        stage = {'name':self.name,
+                 'duration':round(self.duration*1000, 3),
+                 'queries':self.queries,
+                 'sql':round(self.sql_time*1000, 3)}
+        if self.rows is not None:
+            stage['rows'] = self.rows
+        return stage
+
+
+class Instrument(object):
+    """
+    records stages of grid request, queries are counted on connection
+    of given database alias, without alias only durations are recorded
+    """
+    def __init__(self, using = None):
+        self.connection = connections[using] if using is not None else None
+        self.stages = []
+        self.statements = []
+
+    def __enter__(self):
+        if self.connection is not None:
+            # renamed to force_debug_cursor in Django 1.8
+            self.attribute = 'force_debug_cursor' if hasattr(self.connection, 'force_debug_cursor') else 'use_debug_cursor'
+            self.debug_cursor = getattr(self.connection, self.attribute)
+            setattr(self.connection, self.attribute, True)
+            self.first = self.query_count()
+            make_debug_cursor = self.connection.make_debug_cursor
+            self.connection.make_debug_cursor = lambda cursor: StatementCursor(make_debug_cursor(cursor), self.statements)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.connection is not None:
+            setattr(self.connection, self.attribute, self.debug_cursor)
+            del self.connection.make_debug_cursor
+            if not (settings.DEBUG or self.debug_cursor) and isinstance(self.connection.queries, list):
+                # do not keep queries that would not be logged otherwise
+                del self.connection.queries[self.first:]
+        return False
+
+    def query_count(self):
+        return len(self.connection.queries)
+
+    def get_queries(self, first):
+        return self.connection.queries[first:]
+
+    def stage(self, name):
+        """
+        returns context measuring stage with given name
+        """
+        stage = Stage(name, self if self.connection is not None else None)
+        self.stages.append(stage)
+        return stage
+
+    def as_dict(self):
+        return {'duration':round(sum([stage.duration for stage in self.stages])*1000, 3),
+                'queries':sum([stage.queries for stage in self.stages]),
+                'sql':round(sum([stage.sql_time for stage in self.stages])*1000, 3),
+                'stages':[stage.as_dict() for stage in self.stages]}
+
+
+class Sink(object):
+    """
+    base class of receivers of grid request metrics, name is
+    'app_label.model_name' of grid
+    """
+    def emit(self, name, metrics, request, response):
+        raise NotImplementedError
+
+
+class LoggingSink(Sink):
+    """
+    writes one line per request to logger, metrics are passed in
+    'grid_metrics' attribute of log record
+    """
+    def __init__(self, logger = 'djgrid.instrumentation', level = logging.INFO):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def emit(self, name, metrics, request, response):
+        stages = ', '.join(['%s %.1fms/%dq' % (stage['name'], stage['duration'], stage['queries']) for stage in metrics['stages']])
+        self.logger.log(self.level, 'grid %s %.1fms %d queries: %s' % (name, metrics['duration'], metrics['queries'], stages),
+                        extra = {'grid_metrics':metrics})
+
+
+class StatsdSink(Sink):
+    """
+    sends timers of stages and gauges of queries and rows to statsd
+    over UDP, metrics are named 'prefix.app_label.model_name.stage'
+    """
+    def __init__(self, host = 'localhost', port = 8125, prefix = 'djgrid'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def emit(self, name, metrics, request, response):
+        prefix = '%s.%s' % (self.prefix, name)
+        lines = ['%s.duration:%s|ms' % (prefix, metrics['duration']),
+                 '%s.queries:%d|g' % (prefix, metrics['queries'])]
+        for stage in metrics['stages']:
+            lines.append('%s.%s:%s|ms' % (prefix, stage['name'], stage['duration']))
+            lines.append('%s.%s.queries:%d|g' % (prefix, stage['name'], stage['queries']))
+            if 'rows' in stage:
+                lines.append('%s.%s.rows:%d|g' % (prefix, stage['name'], stage['rows']))
+        try:
+            self.socket.sendto('\n'.join(lines), self.address)
+        except socket.error:
+            # metrics must not break grid
+            pass
+
+
+class ServerTimingSink(Sink):
+    """
+    adds Server-Timing header shown by browser developer tools
+    """
+    def emit(self, name, metrics, request, response):
+        timings = ['%s;desc="%d queries";dur=%s' % (stage['name'], stage['queries'], stage['duration']) for stage in metrics['stages']]
+        timings.append('total;dur=%s' % metrics['duration'])
+        response['Server-Timing'] = ', '.join(timings)
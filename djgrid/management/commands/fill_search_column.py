@@ -0,0 +1,28 @@
+from optparse import make_option
+
+from django.db.models import get_model
+from django.core.management.base import BaseCommand, CommandError
+
+from djgrid.search import SearchColumn
+
+
+class Command(BaseCommand):
+    args = '<app_label.model_name> <column> <field> [<field> ...]'
+    help = 'Fills denormalized search column of existing rows, fields are given as in global_search directive'
+    option_list = BaseCommand.option_list+(
+        make_option('--chunk-size', type = 'int', dest = 'chunk_size', default = 1000,
+                    help = 'number of rows read at once'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args)<3:
+            raise CommandError('Usage: fill_search_column %s' % self.args)
+        try:
+            app_label, model_name = args[0].split('.')
+        except ValueError:
+            raise CommandError('Model should be given as app_label.model_name')
+        model = get_model(app_label, model_name)
+        if model is None:
+            raise CommandError('Unknown model %s' % args[0])
+        count = SearchColumn(args[1], args[2:]).fill(model, chunk_size = options['chunk_size'])
+        self.stdout.write('%d rows filled\n' % count)
@@ -0,0 +1,7 @@
+# test runner of Django before 1.7 finds tests only in apps with models module
+from django.db.models import signals
+
+from djgrid.search import update_search_column
+
+# search columns are filled on every save, not only after grid resource is created
+signals.pre_save.connect(update_search_column, dispatch_uid = 'djgrid-search-columns')
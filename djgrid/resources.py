@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 import time as tm
+import hashlib
 import traceback
 from datetime import datetime,date,time
 
 from aed import AED
 from grid import Grid
+from export import EXPORT_FORMATS
+from search import SearchColumn
+from serializers import JSONSerializer
 
 from django import forms
-from django.db import models
+from django.db import models, transaction
+from django.forms.models import model_to_dict
 from django.utils import simplejson
 from django.template import RequestContext
 from django.contrib.auth.models import User
@@ -15,11 +20,21 @@ from django.core.urlresolvers import reverse
 from django.utils.safestring import mark_safe
 from django.db.models import get_model, Sum, Q
 from django.core.context_processors import csrf
-from django.utils.encoding import smart_unicode
+from django.utils.encoding import smart_unicode, force_unicode
+from django.utils.http import http_date, parse_http_date_safe
 from django.conf.urls.defaults import patterns, url
-from django.core.exceptions import ImproperlyConfigured
-from django.shortcuts import get_object_or_404,render_to_response
-from django.http import HttpResponse,Http404,HttpResponseRedirect,Http404
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.shortcuts import render_to_response
+from django.http import HttpResponse,Http404,HttpResponseRedirect,HttpResponseNotModified,HttpResponseBadRequest
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # before Django 1.5 HttpResponse streams iterator content
+    StreamingHttpResponse = HttpResponse
+
+# commit_on_success is replaced by atomic since Django 1.6
+atomic = getattr(transaction, 'atomic', transaction.commit_on_success)
 
 
 """
@@ -36,6 +51,8 @@ class GridResourceOptions(object):
     date_format = "%d.%m.%Y"
     time_format = "%H:%M"
     grid_rownum = 20
+    scroll = False
+    scroll_height = 500
     datepicker_format = "dd.mm.yy"
     timepicker_format = "hh:mm"
     dialog_width = '70%'
@@ -44,6 +61,19 @@ class GridResourceOptions(object):
     save_on_top = False
     navigation = True
     prefix = 'jqgrid-admin'
+    count_strategy = 'exact'
+    count_timeout = 300
+    count_threshold = 10000
+    cache = None
+    search_backend = None
+    serializer = None
+    client_actions = False
+    instrumentation = []
+    timing_payload = False
+    slow_log = None
+    parallel_queries = False
+    export_chunk_size = 1000
+    bulk_chunk_size = 500
     
     def __new__(cls, meta=None):
         overrides = {}
@@ -70,6 +100,14 @@ class GridResource(object):
     
     ALL = 'all'
 
+    def __init__(self):
+        self.column_structures = {}
+        self.form_classes = {}
+        self.started = tm.time()
+        self.serializer = self._meta.serializer or JSONSerializer()
+        if self._meta.cache is not None:
+            self.watch_models()
+
     def check(fn):
         def wrapper(cls, request, *args,**kwargs):
             if not request.user.is_superuser:
@@ -94,13 +132,42 @@ class GridResource(object):
         The standard URLs this ``Grid Resource`` should respond to.
         """
         return [
+            url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/export/(?P<format>%s)/$' % (self._meta.prefix, '|'.join(EXPORT_FORMATS)), self.exportview, name=u"djgrid-exportview"),
+            url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/inline/bulk/$' % self._meta.prefix, self.bulk_inline, name=u"djgrid-bulk-inline"),
+            url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/bulk/(?P<action_name>\w+)/$' % self._meta.prefix, self.bulk_action, name=u"djgrid-bulk-action"),
             url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/(?P<object_id>.+)/(?P<action>.+)/$' % self._meta.prefix, self.actionview, name=u"djgrid-actionview"),
             url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/inline/$' % self._meta.prefix, self.inline, name=u"djgrid-inline"),
             url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/create/$' % self._meta.prefix, self.actionview, name=u"djgrid-createview"),
             url(r'^(?P<prefix>%s)/(?P<app_label>\w+)/(?P<model_name>\w+)/$' % self._meta.prefix, self.listview, name=u"djgrid-listview"),
+            url(r'^(?P<prefix>%s)/slow/$' % self._meta.prefix, self.slowlogview, name=u"djgrid-slowlogview"),
             url(r'^(?P<prefix>%s)/$' % self._meta.prefix, self.indexview, name=u"djgrid-indexview"),
         ]
            
+    def watch_models(self):
+        """
+        invalidates cached responses when registered models or models
+        of their related columns change
+        """
+        for app_label, model_name in self._meta.register:
+            model = get_model(app_label, model_name)
+            fields = self.get_field_list(app_label = app_label, model_name = model_name)
+            dependencies = []
+            for field in fields:
+                field_object = model._meta.get_field(field)
+                if field_object.rel:
+                    dependencies.append(field_object.rel.to)
+            self._meta.cache.watch(model, dependencies)
+    
+    def fill_search_columns(self, chunk_size = 1000):
+        """
+        fills search columns of rows saved before columns were added
+        """
+        for app_label, model_name in self._meta.register:
+            description = self._meta.description.get(model_name, {})
+            if description.get('search_column'):
+                fields = description.get('global_search', self.get_field_list(app_label = app_label, model_name = model_name))
+                SearchColumn(description['search_column'], fields).fill(get_model(app_label, model_name), chunk_size = chunk_size)
+    
     def get_all_model_fields(self, app_label, model_name):
         model = get_model(app_label,model_name)
         fields = [x.name for x in model._meta.fields]
@@ -112,7 +179,7 @@ class GridResource(object):
         """
         try:
             fields = self._meta.description[model_name]['fields'][:]
-        except KeyError,e:
+        except KeyError:
             fields = self.get_all_model_fields(app_label, model_name)
             
         if self._meta.description.has_key(model_name) and 'exclude' in self._meta.description[model_name]:
@@ -143,6 +210,66 @@ class GridResource(object):
             return self._meta.description[model_name]['safe']
         return []
     
+    def get_bulk_actions(self, model_name):
+        """
+        returns dict of custom action name and callable(request, queryset)
+        to run on selected rows
+        """
+        if self._meta.description.has_key(model_name) and 'actions' in self._meta.description[model_name]:
+            return self._meta.description[model_name]['actions']
+        return {}
+    
+    def get_delete_callbacks(self, model_name):
+        """
+        returns callables to call before deleting every object
+        """
+        if self._meta.description.has_key(model_name) and 'delete_callbacks' in self._meta.description[model_name]:
+            return self._meta.description[model_name]['delete_callbacks']
+        return []
+    
+    def get_column_structure(self, app_label, model_name):
+        """
+        returns jqgrid colmodel and colnames json with its etag, structure
+        depends on code only, so it is calculated once per model
+        """
+        key = (app_label, model_name)
+        if key not in self.column_structures:
+            model = get_model(app_label, model_name)
+            fields = self.get_field_list(app_label = app_label, model_name = model_name)
+            final = {}
+            final['colModel'], final['colNames'] = Grid.make_column_structure(model, fields, app_label = app_label, model_name = model_name, safe = self.get_safe_list(model_name), inline = self._meta.inline, readonly = self._meta.readonly, compact = self.serializer.compact, action_url = self.get_action_url(app_label, model_name))
+            final['jsonReader'] = self.serializer.get_reader()
+            content = simplejson.dumps(final)
+            etag = '"%s"' % hashlib.md5(content).hexdigest()
+            self.column_structures[key] = (content, etag)
+        return self.column_structures[key]
+    
+    def get_action_url(self, app_label, model_name):
+        """
+        returns url template of object actions sent with column structure
+        when action links are made by client
+        """
+        if not self._meta.client_actions or self._meta.readonly:
+            return None
+        return Grid.get_action_url_template(self._meta.prefix, app_label, model_name)
+    
+    def column_structure_response(self, request, app_label, model_name):
+        """
+        returns column structure json, answers conditional GET requests
+        with 304 Not Modified
+        """
+        content, etag = self.get_column_structure(app_label, model_name)
+        if request.method=='GET':
+            if request.META.get('HTTP_IF_NONE_MATCH')==etag:
+                return HttpResponseNotModified()
+            modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            if modified_since is not None and 'HTTP_IF_NONE_MATCH' not in request.META and int(self.started)<=modified_since:
+                return HttpResponseNotModified()
+        response = HttpResponse(content,mimetype='application/json')
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(self.started)
+        return response
+    
     def get_field_types(self, fields, model):
         return dict((field, model._meta.get_field(field).__class__.__name__) for field in fields)
         
@@ -165,7 +292,17 @@ class GridResource(object):
         model_name = self._meta.register[0][1]
         
         return HttpResponseRedirect(reverse('djgrid-listview', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name}))
-    
+
+    @check
+    def slowlogview(self, request, prefix):
+        """
+        shows slow grid requests with query plans, latest first
+        """
+        if self._meta.slow_log is None:
+            raise Http404
+        return HttpResponse(simplejson.dumps(self._meta.slow_log.get_entries(), indent = 2),
+                            mimetype = 'application/json')
+
     @check
     def listview(self, request, prefix, app_label, model_name, **kwargs):
         """
@@ -182,12 +319,15 @@ class GridResource(object):
         
         if request.method!="POST":
             
+            if 'initial' in request.GET:
+                return self.column_structure_response(request, app_label, model_name)
+            
             plugins = self.get_plugin_list(app_label, model_name)
             verbose = model._meta.verbose_name
             
             try:
                 register = [[x[0],x[1],get_model(x[0],x[1])._meta.verbose_name.capitalize()] for x in self._meta.register]
-            except AttributeError, e:
+            except AttributeError:
                 raise ImproperlyConfigured("Please, check registered model names")
 
             context = {'app_label':app_label,
@@ -197,96 +337,306 @@ class GridResource(object):
                        'plugins':plugins,
                        'verbose':verbose,
                        'field_types':field_types,
+                       'columns':self.get_column_structure(app_label, model_name)[0].replace('</','<\\/'),
                        'prefix':self._meta.prefix,
                        'navigation':self._meta.navigation,
                        'GRID_ROWNUM':self._meta.grid_rownum,
+                       'scroll':self._meta.scroll,
+                       'scroll_height':self._meta.scroll_height,
                        'DIALOG_WIDTH':self._meta.dialog_width,
                        'DIALOG_MAX_HEIGHT':self._meta.dialog_max_height,
                        'WYSIWYG_HEIGHT':self._meta.wysiwyg_height,
                        'DATEPICKER_FORMAT':self._meta.datepicker_format,
                        'list_url': reverse('djgrid-listview', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name}),
                        'inline_url':reverse('djgrid-inline', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name}),
+                       'bulk_action_url':reverse('djgrid-bulk-action', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name, 'action_name':'delete'}).rsplit('delete/', 1)[0],
+                       'bulk_actions':sorted(self.get_bulk_actions(model_name)),
+                       'readonly':self._meta.readonly,
+                       'inline':self._meta.inline,
+                       'bulk_inline_url':reverse('djgrid-bulk-inline', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name}),
                        'create_url':reverse('djgrid-createview', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name}),
+                       'export_url':reverse('djgrid-exportview', kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name, 'format':'csv'}).rsplit('csv/', 1)[0],
                        }
             return render_to_response('djgrid/djgrid_listview.html',context, context_instance=RequestContext(request))
         
         if request.method=='POST':
                 
             if 'initial' in request.POST:
-                final = {}
-                final['colModel'], final['colNames'] = Grid.make_column_structure(model, fields, app_label = app_label, model_name = model_name, safe = self.get_safe_list(model_name), inline = self._meta.inline, readonly = self._meta.readonly)
-                return HttpResponse(simplejson.dumps(final),mimetype='application/json')
+                return self.column_structure_response(request, app_label, model_name)
             
             else:
-                queryset = model.objects.all()
-                grid = Grid(queryset = queryset,
-                            fields = fields,
-                            post = request.POST,
-                            app_label = app_label,
-                            model_name = model_name,
-                            model = model,
-                            description = self._meta.description,
-                            datetime_format = self._meta.datetime_format,
-                            date_format = self._meta.date_format,
-                            time_format = self._meta.time_format,
-                            url_prefix = self._meta.prefix,
-                            inline = self._meta.inline,
-                            readonly = self._meta.readonly
-                            )
+                cache = self._meta.cache
+                if cache is not None:
+                    # key is taken before grid runs, so that response built
+                    # while model is saved is stored under older generation
+                    key = cache.make_key(self._meta.prefix, model, request.POST)
+                    content = cache.get_value(key)
+                    if content is not None:
+                        return HttpResponse(content,mimetype=self.serializer.content_type)
+                
+                # timing payload is shown only to staff
+                payload = self._meta.timing_payload and request.user.is_staff
+                slow_log = self._meta.slow_log
+                grid = self.get_grid(request.POST, app_label, model_name,
+                                     instrument = bool(self._meta.instrumentation or payload or slow_log))
                 
                 result  = grid.get_data()
+                if payload:
+                    result['timing'] = grid.instrument.as_dict()
+                with grid.instrument.stage('serialize'):
+                    content = self.serializer.dumps(result)
+                
+                if cache is not None and not payload:
+                    cache.set_value(key, content)
                 
-                return HttpResponse(simplejson.dumps(result),mimetype='application/json')
+                response = HttpResponse(content,mimetype=self.serializer.content_type)
+                if self._meta.instrumentation or slow_log is not None:
+                    name = '%s.%s' % (app_label, model_name)
+                    metrics = grid.instrument.as_dict()
+                    for sink in self._meta.instrumentation:
+                        sink.emit(name, metrics, request, response)
+                    if slow_log is not None and slow_log.is_slow(metrics):
+                        slow_log.record(name, grid, request, metrics)
+                return response
                 
+    def get_form_class(self, app_label, model_name):
+        """
+        returns model form of edit dialog, form given in 'form' directive
+        or form created once per model
+        """
+        description = self._meta.description.get(model_name, {})
+        if 'form' in description:
+            return description['form']
+        
+        key = ('form', app_label, model_name, None)
+        if key not in self.form_classes:
+            model_class = get_model(app_label, model_name)
+            callback = self.make_custom_field
+            
+            class InstantForm(forms.ModelForm):
+                formfield_callback = callback
+                class Meta:
+                    model = model_class
+            
+            self.form_classes[key] = InstantForm
+        return self.form_classes[key]
+    
+    def get_inline_form_class(self, app_label, model_name):
+        """
+        returns model form for inline editable grid fields, form given in
+        'inline_form' directive or form created once per model and fields
+        """
+        description = self._meta.description.get(model_name, {})
+        if 'inline_form' in description:
+            return description['inline_form']
+        
+        model_class = get_model(app_label, model_name)
+        inline = []
+        for field in self.get_field_list(app_label = app_label, model_name = model_name):
+            field_object = model_class._meta.get_field(field)
+            field_type = field_object.__class__.__name__
+            if field_type in Grid.INLINE_EDITABLE_FIELDS and not field_object.primary_key and field_object.editable:
+                inline.append(field)
+        
+        key = ('inline', app_label, model_name, tuple(inline))
+        if key not in self.form_classes:
+            class InlineForm(forms.ModelForm):
+                class Meta:
+                    model = model_class
+                    fields = inline
+            
+            self.form_classes[key] = InlineForm
+        return self.form_classes[key]
+    
+    def get_grid(self, params, app_label, model_name, instrument = False):
+        """
+        returns grid of registered model for request parameters
+        """
+        model = get_model(app_label,model_name)
+        return Grid(queryset = model.objects.all(),
+                    fields = self.get_field_list(app_label = app_label, model_name = model_name),
+                    post = params,
+                    app_label = app_label,
+                    model_name = model_name,
+                    model = model,
+                    description = self._meta.description,
+                    datetime_format = self._meta.datetime_format,
+                    date_format = self._meta.date_format,
+                    time_format = self._meta.time_format,
+                    url_prefix = self._meta.prefix,
+                    inline = self._meta.inline,
+                    readonly = self._meta.readonly,
+                    count_strategy = self._meta.count_strategy,
+                    count_timeout = self._meta.count_timeout,
+                    count_threshold = self._meta.count_threshold,
+                    search_backend = self._meta.search_backend,
+                    compact = self.serializer.compact,
+                    client_actions = self._meta.client_actions,
+                    instrument = instrument,
+                    parallel = self._meta.parallel_queries
+                    )
+    
+    @check
+    def exportview(self, request, prefix, app_label, model_name, format):
+        """
+        streams all filtered and ordered grid rows in csv, jsonl or xlsx
+        """
+        if [app_label,model_name] not in self._meta.register:
+            return HttpResponse('not registered')
+        
+        params = request.GET.copy()
+        params['_page'] = '1'
+        params['_rows'] = str(self._meta.export_chunk_size)
+        params.setdefault('_sidx', '')
+        params.setdefault('_sord', 'desc')
+        
+        grid = self.get_grid(params, app_label, model_name)
+        # export is always read by chunks, seek them when possible
+        grid.keyset = True
+        grid.filter()
+        grid.order()
+        grid.project()
+        
+        model = grid.model
+        # lazy translated names can not be written by xlsxwriter
+        header = [force_unicode(model._meta.get_field(field).verbose_name) for field in grid.fields]
+        writer, content_type = EXPORT_FORMATS[format]
+        response = StreamingHttpResponse(writer(grid, header, chunk_size = self._meta.export_chunk_size), content_type = content_type)
+        response['Content-Disposition'] = 'attachment; filename=%s.%s' % (model_name, format)
+        return response
+    
     @check
     def inline(self, request,prefix, app_label, model_name, **kwargs):
         """
         inline model editing
         """
         if request.method=="POST" and self._meta.inline:
-            fields = self.get_field_list(app_label = app_label,model_name = model_name)
             model = get_model(app_label, model_name)
             pk_field = model._meta.pk.name
             pk = request.POST.get(pk_field+'primarykey')
-            instance = get_object_or_404(model, pk = pk)
-            
-            inline = []
-            for field in fields:
-                field_object = model._meta.get_field(field)
-                field_type = field_object.__class__.__name__
-                if field_type in Grid.INLINE_EDITABLE_FIELDS and not field_object.primary_key and field_object.editable:
-                    inline.append(field)
+            if not pk:
+                raise Http404('primary key is required')
             
-            class InlineForm(forms.ModelForm):
-                class Meta:
-                    model = get_model(app_label,model_name)
-                    fields = inline[:]
-          
             aed = AED(request,
                       app_label,
                       model_name,
                       'djgrid/aed_base.html',
-                      InlineForm,
+                      self.get_inline_form_class(app_label, model_name),
                       pk,
                       force_ajax = True,
-                      action = 'edit')
+                      action = 'edit',
+                      model = model)
             aed.process_request() 
             result = {'status':'ok'}
             return HttpResponse(simplejson.dumps(result),mimetype='application/json')
         else:
             return HttpResponse('operation is not allowed')
     
+    @check
+    def bulk_inline(self, request, prefix, app_label, model_name, **kwargs):
+        """
+        saves many inline edited rows in one transaction, POST parameter
+        'rows' is json list of row objects with primary key and changed fields
+        """
+        if request.method!="POST" or not self._meta.inline:
+            return HttpResponse('operation is not allowed')
+        if [app_label,model_name] not in self._meta.register:
+            return HttpResponse('not registered')
+        
+        model = get_model(app_label, model_name)
+        pk_object = model._meta.pk
+        pk_key = pk_object.name+'primarykey'
+        try:
+            rows = simplejson.loads(request.POST['rows'])
+            if not isinstance(rows, list):
+                raise TypeError
+            rows = [(pk_object.to_python(row.pop(pk_key)), row) for row in rows]
+        except (KeyError, ValueError, TypeError, AttributeError, ValidationError):
+            return HttpResponseBadRequest('rows should be json list of objects with %s key' % pk_key)
+        
+        form_class = self.get_inline_form_class(app_label, model_name)
+        fields = form_class._meta.fields
+        instances = model.objects.in_bulk([pk for pk, row in rows])
+        
+        objects = []
+        errors = {}
+        for pk, row in rows:
+            if pk not in instances:
+                errors[pk] = {'__all__':['object does not exist']}
+                continue
+            # fields missing in row keep their current values
+            data = model_to_dict(instances[pk], fields = fields)
+            data.update(row)
+            form = form_class(data = data, instance = instances[pk])
+            if form.is_valid():
+                objects.append(form.save(commit = False))
+            else:
+                errors[pk] = form.errors
+        
+        # batch is saved only when all rows are valid
+        if objects and not errors:
+            with atomic():
+                for obj in objects:
+                    # one update statement without existence check
+                    obj.save(force_update = True)
+        else:
+            objects = []
+        
+        result = {'status':'fail' if errors else 'ok',
+                  'saved':[obj.pk for obj in objects],
+                  'errors':errors}
+        return HttpResponse(simplejson.dumps(result),mimetype='application/json')
+    
+    @check
+    def bulk_action(self, request, prefix, app_label, model_name, action_name):
+        """
+        runs action on selected rows, POST parameter 'ids' contains primary
+        keys of rows. Deletion is done with one queryset operation, or by
+        chunks when delete callbacks must be called for every object
+        """
+        if request.method!="POST" or self._meta.readonly:
+            return HttpResponse('operation is not allowed')
+        if [app_label,model_name] not in self._meta.register:
+            return HttpResponse('not registered')
+        
+        model = get_model(app_label, model_name)
+        try:
+            ids = [model._meta.pk.to_python(pk) for pk in request.POST.getlist('ids')]
+        except ValidationError:
+            return HttpResponseBadRequest('ids should be list of primary keys')
+        queryset = model.objects.filter(pk__in = ids)
+        
+        if action_name=='delete':
+            callbacks = self.get_delete_callbacks(model_name)
+            if callbacks:
+                size = self._meta.bulk_chunk_size
+                for start in range(0, len(ids), size):
+                    with atomic():
+                        objects = model.objects.in_bulk(ids[start:start+size]).values()
+                        for obj in objects:
+                            for callback in callbacks:
+                                callback(obj = obj, form = None, request = request)
+                        model.objects.filter(pk__in = [obj.pk for obj in objects]).delete()
+            else:
+                queryset.delete()
+        else:
+            actions = self.get_bulk_actions(model_name)
+            if action_name not in actions:
+                raise Http404('unknown action %s' % action_name)
+            with atomic():
+                actions[action_name](request, queryset)
+            # actions may update rows without sending signals
+            if self._meta.cache is not None:
+                self._meta.cache.invalidate(model)
+        
+        result = {'status':'ok'}
+        return HttpResponse(simplejson.dumps(result),mimetype='application/json')
+    
     @check
     def actionview(self, request, prefix, app_label, model_name, object_id = None, action = None):
         """
         model instance add-edit-delete operations
         """
-        
-        class InstantForm(forms.ModelForm):
-            formfield_callback = self.make_custom_field
-            class Meta:
-                model = get_model(app_label,model_name)
-                
         url_add = reverse('djgrid-createview',kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name})
         if object_id:
             url_edit = reverse('djgrid-actionview',kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name,'object_id':object_id, 'action':'edit'})
@@ -299,7 +649,7 @@ class GridResource(object):
                   app_label,
                   model_name,
                   'djgrid/aed_base.html',
-                  InstantForm,
+                  self.get_form_class(app_label, model_name),
                   object_id,
                   extra_initial = {},
                   extra_context = {'WYSIWYG_HEIGHT':self._meta.wysiwyg_height},
@@ -307,12 +657,15 @@ class GridResource(object):
                   action = action, 
                   url_add = url_add,
                   url_edit = url_edit, 
-                  url_delete = url_delete)
+                  url_delete = url_delete,
+                  model = get_model(app_label, model_name))
         
         success_redirect_url = reverse('djgrid-listview',kwargs={'prefix':self._meta.prefix,'app_label': app_label,'model_name': model_name})
         aed.add_a_redirect(success_redirect_url)
         aed.add_e_redirect(success_redirect_url)
         aed.add_d_redirect(success_redirect_url)  
+        for callback in self.get_delete_callbacks(model_name):
+            aed.add_d_callback(callback)
         
         return aed.process_request()
 
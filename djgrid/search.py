@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Search backends for free text grid columns.
+
+Text columns listed in 'search' directive are searched by backend instead
+of lookup chosen by filter planner:
+
+    from djgrid.search import PostgresSearchBackend
+    class Resource(GridResource):
+        class Meta:
+            register = [['blog','post']]
+            description = {'post':{'search':{'body':True}}}
+            search_backend = PostgresSearchBackend(config = 'english', rank = True)
+
+Backend of single column can be set in directive instead of True, e.g.
+{'body':PostgresSearchBackend(trigram = True)}.
+
+Backends:
+    - PortableSearchBackend - every word is searched with icontains,
+      works on every database, can not use index
+    - PostgresSearchBackend - tsvector full text or trigram similarity
+      search, uses GIN index on searched expression
+    - SqliteSearchBackend - search in FTS5 table of column, table is
+      created by create_index
+
+Ranked backends order rows by relevance, grid sort column orders rows of
+equal relevance.
+
+SearchColumn keeps denormalized lower case text of several fields in one
+model column, so that global search is one condition on one column. Column
+is filled on save of models listed in DJGRID_SEARCH_COLUMNS setting:
+
+    DJGRID_SEARCH_COLUMNS = {'blog.post':('search_text', ['title','body','author__username'])}
+
+rows saved before it was added are filled by fill method or
+'fill_search_column' management command.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import signals
+from django.utils.encoding import smart_unicode
+
+
+class SearchBackend(object):
+    """
+    base class of search backend
+    """
+    # name of backend shown in filter plan
+    lookup = None
+    indexed = False
+
+    def __init__(self, rank = False):
+        self.rank = rank
+
+    def get_terms(self, value):
+        """
+        returns words of search value
+        """
+        return re.findall(r'\w+', value, re.U)
+
+    def get_column(self, queryset, field_object):
+        """
+        returns quoted column of field for extra sql
+        """
+        qn = connections[queryset.db].ops.quote_name
+        return '%s.%s' % (qn(field_object.model._meta.db_table), qn(field_object.column))
+
+    def search(self, queryset, field_object, value):
+        """
+        returns queryset filtered by search value of field
+        """
+        raise NotImplementedError
+
+    def ranked(self, queryset, field_object, rank, params, descending = True):
+        if not self.rank:
+            return queryset
+        name = 'search_rank_%s' % field_object.column
+        return queryset.extra(select = {name:rank},
+                              select_params = params,
+                              order_by = ['-'+name if descending else name])
+
+
+class PortableSearchBackend(SearchBackend):
+    """
+    search of every word with icontains
+    """
+    lookup = 'words'
+
+    def search(self, queryset, field_object, value):
+        for term in self.get_terms(value):
+            queryset = queryset.filter(**{'%s__icontains' % field_object.name:term})
+        return queryset
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    PostgreSQL full text or trigram search. Searched columns should be
+    indexed by expression used in query:
+        CREATE INDEX ... USING gin (to_tsvector('simple', "body"));
+        CREATE INDEX ... USING gin ("body" gin_trgm_ops);
+    """
+    indexed = True
+
+    def __init__(self, config = 'simple', trigram = False, rank = False):
+        super(PostgresSearchBackend, self).__init__(rank = rank)
+        self.config = config
+        self.trigram = trigram
+        self.lookup = 'trigram' if trigram else 'fulltext'
+
+    def search(self, queryset, field_object, value):
+        column = self.get_column(queryset, field_object)
+        if self.trigram:
+            # pg_trgm similarity operator, percent is escaped for extra
+            queryset = queryset.extra(where = ['%s %%%% %%s' % column], params = [value])
+            return self.ranked(queryset, field_object, 'similarity(%s, %%s)' % column, [value])
+
+        terms = self.get_terms(value)
+        if not terms:
+            return queryset
+        # every word is searched as prefix, words are joined with and
+        query = ' & '.join(['%s:*' % term for term in terms])
+        vector = 'to_tsvector(%%s::regconfig, %s)' % column
+        queryset = queryset.extra(where = ['%s @@ to_tsquery(%%s::regconfig, %%s)' % vector],
+                                  params = [self.config, self.config, query])
+        return self.ranked(queryset, field_object, 'ts_rank(%s, to_tsquery(%%s::regconfig, %%s))' % vector,
+                           [self.config, self.config, query])
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 search, every searched column has its own external
+    content table created by create_index. Model should have integer
+    primary key.
+    """
+    lookup = 'fts5'
+    indexed = True
+
+    def get_table(self, field_object):
+        return '%s_%s_fts' % (field_object.model._meta.db_table, field_object.column)
+
+    def get_query(self, value):
+        # every word is quoted and searched as prefix
+        return ' '.join(['"%s"*' % term for term in self.get_terms(value)])
+
+    def search(self, queryset, field_object, value):
+        query = self.get_query(value)
+        if not query:
+            return queryset
+        qn = connections[queryset.db].ops.quote_name
+        table = qn(self.get_table(field_object))
+        pk = '%s.%s' % (qn(field_object.model._meta.db_table), qn(field_object.model._meta.pk.column))
+        queryset = queryset.extra(where = ['%s IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' % (pk, table, table)],
+                                  params = [query])
+        # fts5 rank is lower for better matches
+        return self.ranked(queryset, field_object, '(SELECT rank FROM %s WHERE %s.rowid = %s AND %s MATCH %%s)' % (table, table, pk, table),
+                           [query], descending = False)
+
+    def create_index(self, model, field, using = DEFAULT_DB_ALIAS):
+        """
+        creates FTS5 table of model field kept up to date by triggers
+        """
+        field_object = model._meta.get_field(field)
+        qn = connections[using].ops.quote_name
+        values = {'fts':qn(self.get_table(field_object)),
+                  'name':self.get_table(field_object),
+                  'table':qn(model._meta.db_table),
+                  'db_table':model._meta.db_table,
+                  'pk':qn(model._meta.pk.column),
+                  'pk_column':model._meta.pk.column,
+                  'column':qn(field_object.column)}
+        statements = [
+            "CREATE VIRTUAL TABLE %(fts)s USING fts5(%(column)s, content='%(db_table)s', content_rowid='%(pk_column)s')",
+            "INSERT INTO %(fts)s(%(fts)s) VALUES('rebuild')",
+            "CREATE TRIGGER %(name)s_ai AFTER INSERT ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(rowid, %(column)s) VALUES (new.%(pk)s, new.%(column)s); END",
+            "CREATE TRIGGER %(name)s_ad AFTER DELETE ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(%(fts)s, rowid, %(column)s) VALUES ('delete', old.%(pk)s, old.%(column)s); END",
+            "CREATE TRIGGER %(name)s_au AFTER UPDATE ON %(table)s BEGIN "
+            "INSERT INTO %(fts)s(%(fts)s, rowid, %(column)s) VALUES ('delete', old.%(pk)s, old.%(column)s); "
+            "INSERT INTO %(fts)s(rowid, %(column)s) VALUES (new.%(pk)s, new.%(column)s); END",
+        ]
+        cursor = connections[using].cursor()
+        for statement in statements:
+            cursor.execute(statement % values)
+        transaction.commit_unless_managed(using = using)
+
+
+class SearchColumn(object):
+    """
+    denormalized text of model fields, column is updated before every
+    save of model instance
+    """
+    def __init__(self, column, fields):
+        self.column = column
+        self.fields = fields
+
+    def get_value(self, instance):
+        """
+        returns lower case text of instance fields, fields of related
+        objects are given by path, e.g. 'author__username'
+        """
+        values = []
+        for field in self.fields:
+            value = instance
+            for name in field.split('__'):
+                value = getattr(value, name, None)
+                if value is None:
+                    break
+            if value is not None:
+                values.append(smart_unicode(value).lower())
+        return ' '.join(values)
+
+    def update(self, sender, instance, **kwargs):
+        setattr(instance, self.column, self.get_value(instance))
+
+    def watch(self, model):
+        signals.pre_save.connect(self.update, sender = model, weak = False,
+                                 dispatch_uid = 'djgrid-search-%s-%s-%s' % (model._meta.app_label, model._meta.object_name, self.column))
+
+    def fill(self, model, chunk_size = 1000):
+        """
+        fills column of all existing rows, rows are read by chunks in
+        primary key order and updated without signals, returns number
+        of updated rows
+        """
+        queryset = model.objects.order_by('pk')
+        related = [field.rsplit('__', 1)[0] for field in self.fields if '__' in field]
+        if related:
+            queryset = queryset.select_related(*related)
+        count = 0
+        last = None
+        while True:
+            chunk = queryset if last is None else queryset.filter(pk__gt = last)
+            chunk = list(chunk[:chunk_size])
+            for instance in chunk:
+                model.objects.filter(pk = instance.pk).update(**{self.column:self.get_value(instance)})
+            count += len(chunk)
+            if len(chunk)<chunk_size:
+                return count
+            last = chunk[-1].pk
+    
+    def search(self, queryset, value):
+        """
+        returns queryset filtered by every word of value
+        """
+        for term in re.findall(r'\w+', value, re.U):
+            queryset = queryset.filter(**{'%s__contains' % self.column:term.lower()})
+        return queryset
+
+
+def update_search_column(sender, instance, **kwargs):
+    """
+    pre_save receiver filling search column of models listed in
+    DJGRID_SEARCH_COLUMNS setting, it is connected by djgrid models
+    module at start of project
+    """
+    columns = getattr(settings, 'DJGRID_SEARCH_COLUMNS', {})
+    key = '%s.%s' % (sender._meta.app_label, sender._meta.object_name.lower())
+    if key in columns:
+        column, fields = columns[key]
+        SearchColumn(column, fields).update(sender, instance)
+
+
+default_backend = PortableSearchBackend()
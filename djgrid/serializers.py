@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Serializers of listview json responses.
+
+JSONSerializer encodes whole response in one call, so that C accelerated
+encoder of simplejson (or json module) is used. Decimals and dates of
+totals are encoded as strings.
+
+In compact mode rows are plain lists of cells with primary key in first
+cell (jqGrid jsonReader with repeatitems and empty cell), instead of
+{'id':pk, 'cell':[...]} object per row:
+
+    from djgrid.serializers import JSONSerializer
+    class Resource(GridResource):
+        class Meta:
+            register = [['blog','post']]
+            serializer = JSONSerializer(compact = True)
+
+Other encoders can be used by overriding dumps method.
+"""
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class JSONSerializer(object):
+    """
+    serializer of grid rows and responses to json
+    """
+    content_type = 'application/json'
+
+    def __init__(self, compact = False):
+        self.compact = compact
+        # separators without spaces make payload smaller
+        self.encoder = DjangoJSONEncoder(separators = (',', ':'))
+
+    def get_reader(self):
+        """
+        returns jqGrid jsonReader of rows made by serializer
+        """
+        if self.compact:
+            return {'repeatitems':True, 'cell':'', 'id':'0'}
+        return {'repeatitems':True}
+
+    def dumps(self, result):
+        return self.encoder.encode(result)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Log of slow grid requests with query plans.
+
+When listview takes longer than threshold, its SELECT statements (count,
+totals aggregate and page queries) are explained and kept with request
+parameters and stage timings in ring buffer of last entries:
+
+    from djgrid.slowlog import SlowGridLog
+    class Resource(GridResource):
+        class Meta:
+            register = [['blog','post']]
+            slow_log = SlowGridLog(threshold = 500, size = 50)
+
+Buffer is shown to superusers at '<prefix>/slow/'. It is kept in memory
+of process, so every worker has its own log.
+"""
+from datetime import datetime
+from collections import deque
+
+from django.db import DatabaseError, transaction
+from django.utils.encoding import smart_unicode
+
+from cache import GridCache
+
+
+class SlowGridLog(object):
+    """
+    ring buffer of grid requests slower than threshold milliseconds
+    """
+    EXPLAIN = {'postgresql':'EXPLAIN ',
+               'mysql':'EXPLAIN ',
+               'sqlite':'EXPLAIN QUERY PLAN '}
+
+    def __init__(self, threshold = 500, size = 50, explain = True):
+        self.threshold = threshold
+        self.explain = explain
+        self.entries = deque(maxlen = size)
+
+    def is_slow(self, metrics):
+        return metrics['duration']>=self.threshold
+
+    def get_plan(self, connection, sql, params):
+        """
+        returns rows of query plan or error message, plans are not
+        available on databases missing in EXPLAIN
+        """
+        if connection.vendor not in SlowGridLog.EXPLAIN:
+            return []
+        # sqlite3 module commits open transaction before EXPLAIN statement
+        if connection.vendor=='sqlite' and transaction.is_managed(using = connection.alias):
+            return ['EXPLAIN skipped in managed transaction']
+        try:
+            cursor = connection.cursor()
+            cursor.execute(SlowGridLog.EXPLAIN[connection.vendor]+sql, params)
+            return [' '.join([smart_unicode(column) for column in row]) for row in cursor.fetchall()]
+        except DatabaseError, e:
+            return ['EXPLAIN failed: %s' % smart_unicode(e)]
+
+    def record(self, name, grid, request, metrics):
+        """
+        adds entry of slow grid request to buffer
+        """
+        statements = []
+        connection = grid.instrument.connection
+        for stage in grid.instrument.stages:
+            for sql, params in stage.statements:
+                # only reads are explained
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                statement = {'stage':stage.name,
+                             'sql':sql,
+                             'params':[smart_unicode(param) for param in params]}
+                if self.explain and connection is not None:
+                    statement['plan'] = self.get_plan(connection, sql, params)
+                statements.append(statement)
+        self.entries.append({'grid':name,
+                             'time':datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                             'user':request.user.username,
+                             # csrf token of other users is not shown
+                             'params':dict([(key, value) for key, value in request.POST.items() if key not in GridCache.IGNORED_PARAMS]),
+                             'duration':metrics['duration'],
+                             'stages':metrics['stages'],
+                             'statements':statements})
+
+    def get_entries(self):
+        """
+        returns entries starting with the latest one
+        """
+        return list(self.entries)[::-1]
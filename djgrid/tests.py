@@ -1,16 +1,1211 @@
+# -*- coding: utf-8 -*-
 """
-This file demonstrates writing tests using the unittest module. These will pass
-when you run "manage.py test".
-
-Replace this with more appropriate tests for your application.
+Grid, its filters and resource views are tested on models of
+django.contrib.auth.
 """
+import os
+import sys
+import csv
+import base64
+import shutil
+import logging
+import zipfile
+import tempfile
+import subprocess
+from StringIO import StringIO
+from decimal import Decimal
+from datetime import date, datetime, timedelta
+
+from django import forms
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.utils import unittest
+from django.test.utils import override_settings
+from django.http import Http404
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import simplejson
+from django.test.client import RequestFactory
+from django.conf.urls.defaults import patterns, include, url
+from django.contrib.auth.models import User, Group, Permission
+
+from djgrid import export
+from djgrid.grid import Grid
+from djgrid.cache import LocMemGridCache, DjangoGridCache
+from djgrid.resources import GridResource
+from djgrid.serializers import JSONSerializer
+from djgrid.instrumentation import Sink, LoggingSink, ServerTimingSink
+from djgrid.slowlog import SlowGridLog
+from djgrid.filters import FilterError, FilterPlanner, FilterCompiler
+from djgrid.search import SearchColumn, PortableSearchBackend, SqliteSearchBackend
+
+
+def day_bounds(field, value):
+    start = datetime.strptime(value, '%d.%m.%Y')
+    return start, start+timedelta(days = 1)
+
+
+class UserResource(GridResource):
+    class Meta:
+        register = [['auth','user'], ['auth','group']]
+        description = {'user':{'fields':['id', 'username', 'first_name', 'is_active', 'date_joined']}}
+
+urlpatterns = patterns('', url(r'^', include(UserResource().urls)))
+
+
+class ResourceTestCase(TestCase):
+    """
+    calls views of resource with requests of superuser
+    """
+    urls = 'djgrid.tests'
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def request(self, method, data = {}):
+        request = getattr(self.factory, method)('/', data)
+        request.user = self.admin
+        return request
+
+
+class FilterPlannerTest(TestCase):
+    def setUp(self):
+        self.planner = FilterPlanner(User)
+
+    def assertLookup(self, lookup, key, value, indexed):
+        self.assertEqual((lookup.key, lookup.value, lookup.indexed), (key, value, indexed))
+
+    def test_text_prefix(self):
+        # unique username is indexed, so prefix search is case sensitive
+        self.assertLookup(self.planner.plan('username', 'adm'), 'username__startswith', 'adm', True)
+        self.assertLookup(self.planner.plan('first_name', 'Jo'), 'first_name__istartswith', 'Jo', False)
+        self.assertLookup(self.planner.plan('username', 'adm', text_lookup = 'contains'), 'username__icontains', 'adm', True)
+
+    def test_text_operators(self):
+        self.assertLookup(self.planner.plan('username', '*dmi'), 'username__icontains', 'dmi', True)
+        self.assertLookup(self.planner.plan('username', '$min'), 'username__iendswith', 'min', True)
+        self.assertLookup(self.planner.plan('username', '=admin'), 'username__exact', 'admin', True)
+        self.assertLookup(self.planner.plan('first_name', '^Jo'), 'first_name__istartswith', 'Jo', False)
+
+    def test_comparisons(self):
+        self.assertLookup(self.planner.plan('id', '5'), 'id__exact', 5, True)
+        self.assertLookup(self.planner.plan('id', '>=5'), 'id__gte', 5, True)
+        self.assertLookup(self.planner.plan('id', '<3'), 'id__lt', 3, True)
+        self.assertLookup(self.planner.plan('is_active', 'yes'), 'is_active__exact', True, False)
+
+    def test_range(self):
+        self.assertLookup(self.planner.plan('id', '2..7'), 'id__range', (2, 7), True)
+        self.assertRaises(FilterError, self.planner.plan, 'id', '2..x')
+
+    def test_cast_errors(self):
+        try:
+            self.planner.plan('id', 'abc')
+        except FilterError, e:
+            self.assertEqual((e.field, e.value), ('id', 'abc'))
+        else:
+            self.fail('FilterError is not raised')
+        self.assertRaises(FilterError, self.planner.plan, 'is_active', 'maybe')
+        self.assertRaises(FilterError, self.planner.plan, 'date_joined', 'yesterday')
+        self.assertRaises(FilterError, self.planner.plan, 'missing', '1')
+
+    def test_related_path(self):
+        planner = FilterPlanner(Permission)
+        self.assertLookup(planner.plan('content_type__model', 'user'), 'content_type__model__istartswith', 'user', False)
+        self.assertLookup(planner.plan('content_type', '3'), 'content_type__exact', 3, True)
+        self.assertRaises(FilterError, planner.plan, 'content_type', 'x')
+
+    def test_indexed_fields_are_memoized(self):
+        indexed = self.planner.get_indexed_fields(User)
+        self.assertTrue('username' in indexed)
+        self.assertFalse('first_name' in indexed)
+        self.assertTrue(self.planner.get_indexed_fields(User) is indexed)
+
+    def test_construct_search_keeps_field_type(self):
+        grid = Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username'],
+                    post = {'_page':'1', '_rows':'10', '_sidx':'', '_sord':'desc'},
+                    model = User)
+        self.assertEqual(grid.construct_search('username', 'adm', field_type = 'CharField'), ('username__startswith', 'adm'))
+
+
+class FilterCompilerTest(TestCase):
+    def setUp(self):
+        start = datetime(2012, 1, 1, 12, 0)
+        for i in range(6):
+            User.objects.create(username = 'user%d' % i,
+                                first_name = 'First' if i%2 else 'Second',
+                                is_active = i<4,
+                                date_joined = start+timedelta(days = i))
+        self.compiler = FilterCompiler(FilterPlanner(User), ['id', 'username', 'first_name', 'is_active', 'date_joined'],
+                                       day_bounds = day_bounds)
+
+    def search(self, group_op, rules, groups = []):
+        filters = simplejson.dumps({'groupOp':group_op,
+                                    'rules':[{'field':field, 'op':op, 'data':data} for field, op, data in rules],
+                                    'groups':groups})
+        condition = self.compiler.compile(filters)
+        queryset = User.objects.all() if condition is None else User.objects.filter(condition)
+        return sorted(queryset.values_list('username', flat = True))
+
+    def test_operators(self):
+        self.assertEqual(self.search('AND', [('username', 'eq', 'user1')]), ['user1'])
+        self.assertEqual(self.search('AND', [('username', 'ne', 'user1'), ('is_active', 'eq', 'true')]), ['user0', 'user2', 'user3'])
+        self.assertEqual(self.search('AND', [('first_name', 'cn', 'ECO')]), ['user0', 'user2', 'user4'])
+        self.assertEqual(self.search('AND', [('username', 'bw', 'user'), ('username', 'en', '5')]), ['user0', 'user1', 'user2', 'user3', 'user4'])
+        self.assertEqual(self.search('AND', [('id', 'in', '%d,%d' % tuple(User.objects.filter(username__in = ['user2', 'user4']).values_list('id', flat = True)))]), ['user2', 'user4'])
+        self.assertEqual(self.search('AND', []), ['user0', 'user1', 'user2', 'user3', 'user4', 'user5'])
+
+    def test_day_bounds(self):
+        self.assertEqual(self.search('AND', [('date_joined', 'eq', '03.01.2012')]), ['user2'])
+        self.assertEqual(self.search('AND', [('date_joined', 'le', '02.01.2012')]), ['user0', 'user1'])
+        self.assertEqual(self.search('AND', [('date_joined', 'lt', '02.01.2012')]), ['user0'])
+        self.assertEqual(self.search('AND', [('date_joined', 'gt', '05.01.2012')]), ['user5'])
+        self.assertEqual(self.search('AND', [('date_joined', 'ge', '05.01.2012')]), ['user4', 'user5'])
+
+    def test_nested_groups(self):
+        groups = [{'groupOp':'OR', 'rules':[{'field':'username', 'op':'eq', 'data':'user1'},
+                                            {'field':'username', 'op':'eq', 'data':'user5'}]}]
+        self.assertEqual(self.search('AND', [('first_name', 'eq', 'first')], groups), ['user1', 'user5'])
+        self.assertEqual(self.search('OR', [('username', 'eq', 'user0')], groups), ['user0', 'user1', 'user5'])
+
+    def test_errors(self):
+        self.assertRaises(FilterError, self.search, 'AND', [('email', 'eq', 'x')])
+        self.assertRaises(FilterError, self.search, 'AND', [('username', 'xx', 'x')])
+        self.assertRaises(FilterError, self.search, 'AND', [('id', 'cn', '1')])
+        self.assertRaises(FilterError, self.search, 'AND', [('id', 'eq', 'abc')])
+        self.assertRaises(FilterError, self.search, 'XOR', [('id', 'eq', '1')])
+        self.assertRaises(FilterError, self.compiler.compile, '{not json')
+        group = {'groupOp':'AND', 'rules':[]}
+        for i in range(FilterCompiler.MAX_DEPTH+1):
+            group = {'groupOp':'AND', 'rules':[], 'groups':[group]}
+        self.assertRaises(FilterError, self.compiler.compile, simplejson.dumps(group))
+
+    def test_compiled_shape_is_reused(self):
+        self.assertEqual(self.search('AND', [('username', 'eq', 'user1')]), ['user1'])
+        shapes = len(FilterCompiler.shapes)
+        self.assertEqual(self.search('AND', [('username', 'eq', 'user2')]), ['user2'])
+        self.assertEqual(len(FilterCompiler.shapes), shapes)
+
+
+class EstimatedGrid(Grid):
+    def estimate_count(self):
+        return 12
+
+
+class GridCountTest(TestCase):
+    def setUp(self):
+        for i in range(25):
+            User.objects.create(username = 'user%02d' % i)
+
+    def get_data(self, page, grid_class = Grid, **kwargs):
+        grid = grid_class(queryset = User.objects.all(),
+                          fields = ['id', 'username'],
+                          post = {'_page':str(page), '_rows':'5', '_sidx':'id', '_sord':'desc'},
+                          model = User,
+                          readonly = True,
+                          **kwargs)
+        return grid.get_data()
+
+    def test_exact(self):
+        data = self.get_data(7)
+        self.assertEqual((data['page'], data['total'], data['records']), (5, 5, 25))
+        self.assertFalse('approximate' in data)
+
+    def test_limited_pages_past_threshold(self):
+        data = self.get_data(1, count_strategy = 'limited', count_threshold = 10)
+        self.assertEqual((data['total'], data['records'], data['approximate'], data['lower_bound']), (2, 10, True, True))
+        # full pages past counted records keep next page open
+        for page in (2, 3, 4):
+            data = self.get_data(page, count_strategy = 'limited', count_threshold = 10)
+            self.assertEqual((data['page'], data['total'], len(data['rows'])), (page, page+1, 5))
+            self.assertTrue(data['lower_bound'])
+        data = self.get_data(5, count_strategy = 'limited', count_threshold = 10)
+        self.assertEqual((data['page'], data['total'], len(data['rows'])), (5, 6, 5))
+        # empty page closes paging, short one gives exact number of rows
+        data = self.get_data(6, count_strategy = 'limited', count_threshold = 10)
+        self.assertEqual((data['page'], data['total'], len(data['rows'])), (6, 6, 0))
+        User.objects.create(username = 'user25')
+        data = self.get_data(6, count_strategy = 'limited', count_threshold = 10)
+        self.assertEqual((data['page'], data['total'], data['records'], len(data['rows'])), (6, 6, 26, 1))
+        self.assertFalse('approximate' in data or 'lower_bound' in data)
+
+    def test_limited_under_threshold(self):
+        data = self.get_data(1, count_strategy = 'limited', count_threshold = 100)
+        self.assertEqual((data['total'], data['records']), (5, 25))
+        self.assertFalse('approximate' in data)
+
+    def test_estimate(self):
+        # estimate of sqlite is not available, grid counts exactly
+        data = self.get_data(1, count_strategy = 'estimate')
+        self.assertEqual((data['total'], data['records']), (5, 25))
+        self.assertFalse('approximate' in data)
+        data = self.get_data(1, grid_class = EstimatedGrid, count_strategy = 'estimate')
+        self.assertEqual((data['total'], data['records'], data['approximate']), (3, 12, True))
+        self.assertFalse('lower_bound' in data)
+        data = self.get_data(5, grid_class = EstimatedGrid, count_strategy = 'estimate')
+        self.assertEqual((data['page'], data['total'], data['records']), (5, 6, 12))
+        data = self.get_data(6, grid_class = EstimatedGrid, count_strategy = 'estimate')
+        self.assertEqual(data['total'], 6)
+
+    def test_cached(self):
+        data = self.get_data(1, count_strategy = 'cached')
+        self.assertEqual((data['records'], data.get('approximate')), (25, None))
+        User.objects.create(username = 'user25')
+        data = self.get_data(1, count_strategy = 'cached')
+        self.assertEqual((data['records'], data['approximate']), (25, True))
+        # cached count keeps page within counted pages
+        data = self.get_data(9, count_strategy = 'cached')
+        self.assertEqual((data['page'], data['total']), (5, 5))
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ImproperlyConfigured, self.get_data, 1, count_strategy = 'guess')
+
+
+class BulkActionTest(ResourceTestCase):
+    def setUp(self):
+        super(BulkActionTest, self).setUp()
+        self.deleted = []
+        self.groups = [Group.objects.create(name = 'group%d' % i).pk for i in range(5)]
+
+    def get_resource(self, **description):
+        class Resource(GridResource):
+            class Meta:
+                register = [['auth','group']]
+        Resource._meta.description = {'group':description}
+        return Resource()
+
+    def bulk(self, resource, action_name, ids, model_name = 'group'):
+        request = self.request('post', {'ids':ids})
+        return resource.bulk_action(request, 'jqgrid-admin', 'auth', model_name, action_name)
+
+    def test_delete(self):
+        response = self.bulk(self.get_resource(), 'delete', self.groups[:3])
+        self.assertEqual(simplejson.loads(response.content), {'status':'ok'})
+        self.assertEqual(list(Group.objects.values_list('pk', flat = True).order_by('pk')), self.groups[3:])
+
+    def test_delete_with_callbacks(self):
+        def callback(obj, form, request):
+            self.deleted.append(obj.name)
+        resource = self.get_resource(delete_callbacks = [callback])
+        resource._meta.bulk_chunk_size = 2
+        self.bulk(resource, 'delete', self.groups[1:4])
+        self.assertEqual(sorted(self.deleted), ['group1', 'group2', 'group3'])
+        self.assertEqual(list(Group.objects.values_list('name', flat = True).order_by('pk')), ['group0', 'group4'])
+
+    def test_custom_action(self):
+        def rename(request, queryset):
+            for group in queryset:
+                group.name = 'renamed %s' % group.name
+                group.save()
+        resource = self.get_resource(actions = {'rename':rename})
+        self.bulk(resource, 'rename', self.groups[:2])
+        self.assertEqual(Group.objects.filter(name__startswith = 'renamed').count(), 2)
+        self.assertRaises(Http404, self.bulk, resource, 'missing', self.groups[:2])
+
+    def test_errors(self):
+        resource = self.get_resource()
+        self.assertEqual(self.bulk(resource, 'delete', ['x']).status_code, 400)
+        # models which are not registered can not be changed
+        response = self.bulk(resource, 'delete', self.groups, model_name = 'user')
+        self.assertEqual(response.content, 'not registered')
+        response = self.bulk(resource, 'delete', self.groups, model_name = 'missing')
+        self.assertEqual(response.content, 'not registered')
+        self.assertEqual(Group.objects.count(), 5)
+        request = self.request('post', {'ids':self.groups})
+        request.user = User.objects.create_user('user', 'user@example.com', 'user')
+        self.assertEqual(resource.bulk_action(request, 'jqgrid-admin', 'auth', 'group', 'delete').status_code, 302)
+        self.assertEqual(Group.objects.count(), 5)
+
+
+@override_settings(DJGRID_SEARCH_COLUMNS = {'auth.user':('email', ['username', 'first_name'])})
+class GlobalSearchTest(TestCase):
+    def setUp(self):
+        for i in range(4):
+            User.objects.create(username = 'user%d' % i,
+                                first_name = 'Ann' if i%2 else 'Bob',
+                                date_joined = datetime(2012, 1, 1+i, 12, 0))
+
+    def search(self, value, **description):
+        grid = Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username', 'first_name', 'is_active', 'date_joined'],
+                    post = {'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc', '_global':value},
+                    model = User,
+                    model_name = 'user',
+                    inline = False,
+                    readonly = True,
+                    description = {'user':description})
+        data = grid.get_data()
+        return [row['cell'][1] for row in data['rows']]
+
+    def test_fields(self):
+        self.assertEqual(self.search('ser1'), ['user1'])
+        self.assertEqual(self.search('ann'), ['user1', 'user3'])
+        self.assertEqual(self.search('^ser'), [])
+        self.assertEqual(self.search('02.01.2012'), ['user1'])
+        self.assertEqual(self.search('ann', global_search = ['username']), [])
+        self.assertEqual(self.search('zzz'), [])
+
+    def test_column_is_filled_on_save(self):
+        self.assertEqual(User.objects.get(username = 'user1').email, 'user1 ann')
+        user = User.objects.get(username = 'user2')
+        user.first_name = 'Carl'
+        user.save()
+        self.assertEqual(User.objects.get(username = 'user2').email, 'user2 carl')
+        self.assertEqual(self.search('CARL user', search_column = 'email'), ['user2'])
+        self.assertEqual(self.search('ann user1', search_column = 'email'), ['user1'])
+
+    def test_fill(self):
+        User.objects.update(email = '')
+        self.assertEqual(SearchColumn('email', ['username', 'first_name']).fill(User, chunk_size = 3), 4)
+        self.assertEqual(list(User.objects.order_by('pk').values_list('email', flat = True)),
+                         ['user0 bob', 'user1 ann', 'user2 bob', 'user3 ann'])
+
+
+class BulkInlineTest(ResourceTestCase):
+    def setUp(self):
+        super(BulkInlineTest, self).setUp()
+        self.resource = UserResource()
+        self.users = [User.objects.create(username = 'user%d' % i, first_name = 'First').pk for i in range(3)]
+
+    def save(self, rows, model_name = 'user'):
+        request = self.request('post', {'rows':simplejson.dumps(rows)})
+        return self.resource.bulk_inline(request, 'jqgrid-admin', 'auth', model_name)
+
+    def names(self):
+        return list(User.objects.filter(pk__in = self.users).order_by('pk').values_list('username', 'first_name'))
+
+    def test_save(self):
+        response = self.save([{'idprimarykey':self.users[0], 'first_name':'Ann'},
+                              {'idprimarykey':self.users[1], 'username':'renamed'}])
+        result = simplejson.loads(response.content)
+        self.assertEqual((result['status'], sorted(result['saved'])), ('ok', self.users[:2]))
+        # fields missing in row keep their values
+        self.assertEqual(self.names(), [(u'user0', u'Ann'), (u'renamed', u'First'), (u'user2', u'First')])
+
+    def test_all_or_nothing(self):
+        response = self.save([{'idprimarykey':self.users[0], 'first_name':'Ann'},
+                              {'idprimarykey':self.users[1], 'username':'user2'},
+                              {'idprimarykey':0, 'first_name':'Bob'}])
+        result = simplejson.loads(response.content)
+        self.assertEqual((result['status'], result['saved']), ('fail', []))
+        self.assertEqual(sorted(result['errors']), ['0', str(self.users[1])])
+        self.assertTrue('username' in result['errors'][str(self.users[1])])
+        self.assertEqual(self.names(), [(u'user0', u'First'), (u'user1', u'First'), (u'user2', u'First')])
+
+    def test_bad_rows(self):
+        for rows in ('{not json', '{}', '[1]', '[{"first_name":"Ann"}]', '[{"idprimarykey":"x"}]'):
+            request = self.request('post', {'rows':rows})
+            self.assertEqual(self.resource.bulk_inline(request, 'jqgrid-admin', 'auth', 'user').status_code, 400)
+        request = self.request('post', {})
+        self.assertEqual(self.resource.bulk_inline(request, 'jqgrid-admin', 'auth', 'user').status_code, 400)
+        self.assertEqual(self.save([{'idprimarykey':1}], model_name = 'permission').content, 'not registered')
+        self.assertEqual(self.names(), [(u'user0', u'First'), (u'user1', u'First'), (u'user2', u'First')])
+
+
+class DateFilterTest(TestCase):
+    def setUp(self):
+        for i, joined in enumerate([datetime(2012, 1, 1, 0, 0),
+                                    datetime(2012, 1, 1, 23, 59, 59, 999000),
+                                    datetime(2012, 1, 2, 0, 0),
+                                    datetime(2012, 1, 3, 12, 0)]):
+            User.objects.create(username = 'user%d' % i, date_joined = joined)
+
+    def get_grid(self, value):
+        return Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username', 'date_joined'],
+                    post = {'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc', '_search':'true', 'date_joined':value},
+                    model = User,
+                    inline = False,
+                    readonly = True)
+
+    def search(self, value):
+        data = self.get_grid(value).get_data()
+        return [row['cell'][1] for row in data['rows']]
+
+    def test_day(self):
+        self.assertEqual(self.search('01.01.2012'), ['user0', 'user1'])
+        self.assertEqual(self.search('02.01.2012'), ['user2'])
+        self.assertEqual(self.search('04.01.2012'), [])
+
+    def test_ranges(self):
+        self.assertEqual(self.search('01.01.2012..02.01.2012'), ['user0', 'user1', 'user2'])
+        self.assertEqual(self.search('02.01.2012..'), ['user2', 'user3'])
+        self.assertEqual(self.search('..01.01.2012'), ['user0', 'user1'])
+        self.assertEqual(self.search(' 03.01.2012 .. 03.01.2012 '), ['user3'])
+
+    def test_half_open_bounds(self):
+        grid = self.get_grid('')
+        lookups = grid.date_lookups('date_joined', '01.01.2012..02.01.2012')
+        self.assertEqual([(lookup.key, lookup.value) for lookup in lookups],
+                         [('date_joined__gte', datetime(2012, 1, 1)), ('date_joined__lt', datetime(2012, 1, 3))])
+        self.assertEqual(grid.day_bounds('date_joined', '02.01.2012'), (datetime(2012, 1, 2), datetime(2012, 1, 3)))
+        self.assertRaises(FilterError, grid.day_bounds, 'date_joined', '01.01.2012..')
+
+    def test_errors(self):
+        for value in ('32.01.2012', '..', '01.01.2012..x'):
+            data = self.get_grid(value).get_data()
+            self.assertEqual((data['records'], data['rows']), (0, []))
+            self.assertTrue('date_joined' in data['errors'])
+
+
+class TotalsTest(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username = 'user%d' % i,
+                                          is_active = i<3,
+                                          date_joined = datetime(2012, 1, 1+i, 12, 0)).pk for i in range(4)]
+
+    def get_grid(self, totals, **post):
+        post.update({'_page':'1', '_rows':'2', '_sidx':'id', '_sord':'desc'})
+        return Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username', 'is_active', 'date_joined'],
+                    post = post,
+                    model = User,
+                    model_name = 'user',
+                    readonly = True,
+                    datetime_format = '%d.%m.%Y %H:%M',
+                    description = {'user':{'totals':totals}})
+
+    def test_totals_and_count_in_one_query(self):
+        grid = self.get_grid({'id':'sum', 'date_joined':'max', 'username':'count'})
+        # aggregate with count and page rows
+        with self.assertNumQueries(2):
+            data = grid.get_data()
+        self.assertEqual(data['records'], 4)
+        self.assertEqual(data['userdata'], {'id':float(sum(self.users)),
+                                            'username':4.0,
+                                            'date_joined':'04.01.2012 12:00'})
+
+    def test_filtered_totals(self):
+        data = self.get_grid(['id'], _search = 'true', is_active = 'true').get_data()
+        self.assertEqual((data['records'], data['userdata']['id']), (3, float(sum(self.users[:3]))))
+
+    def test_default_totals(self):
+        # numeric columns are summed, primary key and booleans are not
+        self.assertEqual(self.get_grid(None).get_totals(), {})
+        self.assertEqual(self.get_grid(['id']).get_totals(), {'id':'sum'})
+
+    def test_unknown_function(self):
+        self.assertRaises(ImproperlyConfigured, self.get_grid({'id':'median'}).get_data)
+
+
+class KeysetTest(TestCase):
+    def setUp(self):
+        # equal sort values are ordered by primary key
+        for i in range(12):
+            User.objects.create(username = 'user%02d' % i, first_name = 'name%d' % (i%3))
+
+    def get_grid(self, page, sidx = 'first_name', sord = 'desc', cursor = None, **post):
+        post.update({'_page':str(page), '_rows':'3', '_sidx':sidx, '_sord':sord})
+        if cursor:
+            post['_cursor'] = cursor
+        return Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username', 'first_name'],
+                    post = post,
+                    model = User,
+                    model_name = 'user',
+                    inline = False,
+                    readonly = True,
+                    description = {'user':{'pagination':'keyset'}})
+
+    def names(self, data):
+        return [row['cell'][1] for row in data['rows']]
+
+    def expected(self, page, sidx = 'first_name', sord = 'desc', queryset = None):
+        # sort order of grid is reversed, 'asc' sorts descending
+        prefix = '-' if sord=='asc' else ''
+        ordering = [prefix+sidx] if sidx else []
+        ordering.append(prefix+'pk')
+        queryset = User.objects.all() if queryset is None else queryset
+        return list(queryset.order_by(*ordering).values_list('username', flat = True)[page*3-3:page*3])
+
+    def test_pages_follow_cursor(self):
+        for sidx, sord in (('first_name', 'desc'), ('first_name', 'asc'), ('', 'desc'), ('username', 'asc')):
+            data = self.get_grid(1, sidx, sord).get_data()
+            pages = [self.names(data)]
+            for page in (2, 3, 4, 3, 3, 2):
+                grid = self.get_grid(page, sidx, sord, data['cursor'])
+                data = grid.get_data()
+                self.assertTrue(grid.decode_cursor() is not None)
+                self.assertEqual(self.names(data), self.expected(page, sidx, sord))
+
+    def test_cursor_of_other_query_is_rejected(self):
+        cursor = self.get_grid(1).get_data()['cursor']
+        grid = self.get_grid(2, cursor = cursor, _search = 'true', username = 'user0')
+        self.assertEqual(self.names(grid.get_data()), self.expected(2, queryset = User.objects.filter(username__startswith = 'user0')))
+        self.assertTrue(grid.decode_cursor() is None)
+        # cursor of other sort or page size
+        grid = self.get_grid(2, 'username', cursor = cursor)
+        grid.get_data()
+        self.assertTrue(grid.decode_cursor() is None)
+
+    def test_broken_cursor_falls_back_to_offset(self):
+        for cursor in ('x', 'bm90IGpzb24=', base64.urlsafe_b64encode(simplejson.dumps({'page':1}))):
+            grid = self.get_grid(2, cursor = cursor)
+            self.assertEqual(self.names(grid.get_data()), self.expected(2))
+            self.assertTrue(grid.decode_cursor() is None)
+
+    def test_cursor_round_trip(self):
+        grid = self.get_grid(1)
+        data = grid.get_data()
+        cursor = simplejson.loads(base64.urlsafe_b64decode(str(data['cursor'])))
+        first, last = User.objects.order_by('first_name', 'pk')[0], User.objects.order_by('first_name', 'pk')[2]
+        self.assertEqual((cursor['page'], cursor['rows'], cursor['query']), (1, 3, grid.digest))
+        self.assertEqual((cursor['first'], cursor['last']), ([first.first_name, unicode(first.pk)], [last.first_name, unicode(last.pk)]))
+
+    def test_related_sort_uses_offset(self):
+        grid = Grid(queryset = Permission.objects.all(), fields = ['id', 'content_type'], model = Permission, model_name = 'permission',
+                    post = {'_page':'1', '_rows':'3', '_sidx':'content_type', '_sord':'desc'},
+                    description = {'permission':{'pagination':'keyset'}})
+        self.assertTrue(grid.keyset_field() is None)
+
+
+class ListviewCacheTest(ResourceTestCase):
+    def setUp(self):
+        super(ListviewCacheTest, self).setUp()
+        class Resource(UserResource):
+            class Meta:
+                register = [['auth','user']]
+                description = UserResource._meta.description
+                cache = LocMemGridCache(timeout = 60, max_entries = 10)
+        self.resource = Resource()
+        self.cache = Resource._meta.cache
+
+    def listview(self, **params):
+        params.update({'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc'})
+        response = self.resource.listview(self.request('post', params), 'jqgrid-admin', 'auth', 'user')
+        return simplejson.loads(response.content)
+
+    def test_cached_response(self):
+        data = self.listview(nd = '1')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.listview(nd = '2', csrfmiddlewaretoken = 'x'), data)
+        self.assertEqual(self.listview(_search = 'true', username = 'adm')['records'], 1)
+
+    def test_invalidation(self):
+        self.assertEqual(self.listview()['records'], 1)
+        user = User.objects.create(username = 'user')
+        self.assertEqual(self.listview()['records'], 2)
+        user.first_name = 'Changed'
+        user.save()
+        self.assertEqual(self.listview()['rows'][1]['cell'][3], 'Changed')
+        user.delete()
+        self.assertEqual(self.listview()['records'], 1)
+        # bulk updates do not send signals
+        User.objects.update(first_name = 'Updated')
+        self.assertNotEqual(self.listview()['rows'][0]['cell'][3], 'Updated')
+        self.cache.invalidate(User)
+        self.assertEqual(self.listview()['rows'][0]['cell'][3], 'Updated')
+
+    def test_key_is_normalized(self):
+        first = self.cache.make_key('grid', User, {'b':'1', 'a':'2', 'nd':'1'})
+        self.assertEqual(self.cache.make_key('grid', User, {'a':'2', 'b':'1', 'nd':'2'}), first)
+        self.assertNotEqual(self.cache.make_key('grid', User, {'a':'2', 'b':'2'}), first)
+        self.assertNotEqual(self.cache.make_key('other', User, {'a':'2', 'b':'1'}), first)
+
+    def test_least_recently_used_entries_are_dropped(self):
+        cache = LocMemGridCache(timeout = 60, max_entries = 2)
+        for key in ('a', 'b'):
+            cache.set_value(key, key)
+        cache.get_value('a')
+        cache.set_value('c', 'c')
+        self.assertEqual([cache.get_value(key) for key in ('a', 'b', 'c')], ['a', None, 'c'])
+        cache = LocMemGridCache(timeout = -1)
+        cache.set_value('a', 'a')
+        self.assertEqual(cache.get_value('a'), None)
+
+    def test_django_cache(self):
+        cache = DjangoGridCache()
+        cache.set('grid', User, {'a':'1'}, 'value')
+        self.assertEqual(cache.get('grid', User, {'a':'1'}), 'value')
+        cache.invalidate(User)
+        self.assertEqual(cache.get('grid', User, {'a':'1'}), None)
+
+
+class ColumnStructureTest(ResourceTestCase):
+    def setUp(self):
+        super(ColumnStructureTest, self).setUp()
+        self.resource = UserResource()
+
+    def initial(self, method = 'get', **headers):
+        request = getattr(self.factory, method)('/', {'initial':'1'}, **headers)
+        request.user = self.admin
+        return self.resource.listview(request, 'jqgrid-admin', 'auth', 'user')
+
+    def test_structure(self):
+        response = self.initial()
+        structure = simplejson.loads(response.content)
+        self.assertEqual(structure['colNames'], ['idprimarykey', 'id', 'username', 'first name', 'active', 'date joined', 'actions'])
+        self.assertEqual([column['name'] for column in structure['colModel']],
+                         ['idprimarykey', 'id', 'username', 'first_name', 'is_active', 'date_joined', 'actions'])
+        self.assertFalse('editable' in structure['colModel'][1])
+        self.assertTrue(structure['colModel'][2]['editable'])
+        # structure is made once per model
+        self.assertEqual(self.resource.column_structures.keys(), [('auth', 'user')])
+        self.assertEqual(self.initial(method = 'post').content, response.content)
+
+    def test_conditional_get(self):
+        response = self.initial()
+        self.assertEqual(self.initial(HTTP_IF_NONE_MATCH = response['ETag']).status_code, 304)
+        self.assertEqual(self.initial(HTTP_IF_NONE_MATCH = '"other"').status_code, 200)
+        self.assertEqual(self.initial(HTTP_IF_MODIFIED_SINCE = response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.initial(HTTP_IF_MODIFIED_SINCE = 'Sat, 01 Jan 2000 00:00:00 GMT').status_code, 200)
+        # post is never answered with 304
+        self.assertEqual(self.initial(method = 'post', HTTP_IF_NONE_MATCH = response['ETag']).status_code, 200)
+
+
+class ExportTest(ResourceTestCase):
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        for i in range(4):
+            User.objects.create(username = 'user%d' % i, first_name = u'Jörg %d' % i,
+                                date_joined = datetime(2012, 1, 1+i, 12, 0))
+        self.resource = UserResource()
+        self.resource._meta.export_chunk_size = 2
+
+    def tearDown(self):
+        del UserResource._meta.export_chunk_size
+
+    def get_export(self, format, **params):
+        request = self.factory.get('/', params)
+        request.user = self.admin
+        response = self.resource.exportview(request, 'jqgrid-admin', 'auth', 'user', format)
+        return response, ''.join(response)
+
+    def test_csv(self):
+        response, content = self.get_export('csv', _sidx = 'username', _sord = 'asc')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=user.csv')
+        rows = list(csv.reader(StringIO(content)))
+        self.assertEqual(rows[0], ['ID', 'username', 'first name', 'active', 'date joined'])
+        self.assertEqual([row[1] for row in rows[1:]], ['user3', 'user2', 'user1', 'user0', 'admin'])
+        self.assertEqual(rows[1][2], u'Jörg 3'.encode('utf-8'))
+
+    def test_jsonl_is_filtered(self):
+        response, content = self.get_export('jsonl', _search = 'true', username = 'user')
+        rows = [simplejson.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['username'] for row in rows], ['user0', 'user1', 'user2', 'user3'])
+        self.assertEqual(rows[0]['first_name'], u'Jörg 0')
+
+    def test_offset_chunks(self):
+        # sort column with equal values is read by offset ordered by primary key
+        User.objects.update(first_name = 'same')
+        response, content = self.get_export('jsonl', _sidx = 'first_name')
+        self.assertEqual([simplejson.loads(line)['id'] for line in content.splitlines()],
+                         list(User.objects.order_by('pk').values_list('pk', flat = True)))
+
+    @unittest.skipIf(export.xlsxwriter is None, 'XlsxWriter is not installed')
+    def test_xlsx_sheets(self):
+        max_rows = export.XLSX_MAX_ROWS
+        export.XLSX_MAX_ROWS = 3
+        try:
+            response, content = self.get_export('xlsx')
+        finally:
+            export.XLSX_MAX_ROWS = max_rows
+        # five rows continue on next sheets after two rows and header
+        names = zipfile.ZipFile(StringIO(content)).namelist()
+        self.assertEqual(sorted([name for name in names if name.startswith('xl/worksheets/sheet')]),
+                         ['xl/worksheets/sheet1.xml', 'xl/worksheets/sheet2.xml', 'xl/worksheets/sheet3.xml'])
+
+
+def has_fts5():
+    if connection.vendor!='sqlite':
+        return False
+    # checked on separate database, test database does not exist yet
+    import sqlite3
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts USING fts5(text)')
+    except sqlite3.Error:
+        return False
+    return True
+
+
+class SearchMixin(object):
+    def create_users(self):
+        for i, name in enumerate(['Anna Maria', 'Maria', 'Marianne Anna', 'Bob']):
+            User.objects.create(username = 'user%d' % i, first_name = name)
+
+    def search(self, value, backend, keyset = False):
+        description = {'search':{'first_name':True}}
+        if keyset:
+            description['pagination'] = 'keyset'
+        grid = Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username', 'first_name'],
+                    post = {'_page':'1', '_rows':'10', '_sidx':'username', '_sord':'desc', '_search':'true', 'first_name':value},
+                    model = User,
+                    model_name = 'user',
+                    inline = False,
+                    readonly = True,
+                    search_backend = backend,
+                    description = {'user':description})
+        data = grid.get_data()
+        self.grid = grid
+        return [row['cell'][1] for row in data['rows']]
+
+
+class SearchBackendTest(SearchMixin, TestCase):
+    def setUp(self):
+        self.create_users()
+
+    def test_portable(self):
+        backend = PortableSearchBackend()
+        self.assertEqual(self.search('ann', backend), ['user0', 'user2'])
+        self.assertEqual(self.search('maria anna', backend), ['user0', 'user2'])
+        self.assertEqual(self.search('bob', backend), ['user3'])
+        self.assertEqual(self.search('  ', backend), ['user0', 'user1', 'user2', 'user3'])
+        self.assertEqual([(lookup.key, lookup.indexed) for lookup in self.grid.plan], [('first_name__words', False)])
+
+    def test_directive_backend(self):
+        grid = Grid(queryset = User.objects.all(), fields = ['id', 'first_name'], model = User, model_name = 'user',
+                    post = {'_page':'1', '_rows':'10', '_sidx':'', '_sord':'desc', '_search':'true', 'first_name':'bob'},
+                    description = {'user':{'search':{'first_name':PortableSearchBackend()}}})
+        self.assertEqual(grid.get_data()['records'], 1)
+
+
+@unittest.skipUnless(has_fts5(), 'SQLite FTS5 is not available')
+class SqliteSearchBackendTest(SearchMixin, TransactionTestCase):
+    """
+    schema statements commit transaction on sqlite, so index is dropped
+    after every test
+    """
+    def setUp(self):
+        self.create_users()
+        self.backend = SqliteSearchBackend(rank = True)
+        self.backend.create_index(User, 'first_name')
+
+    def tearDown(self):
+        table = self.backend.get_table(User._meta.get_field('first_name'))
+        cursor = connection.cursor()
+        for trigger in ('ai', 'ad', 'au'):
+            cursor.execute('DROP TRIGGER %s_%s' % (table, trigger))
+        cursor.execute('DROP TABLE %s' % table)
+
+    def test_search(self):
+        # words are searched by prefix
+        self.assertEqual(set(self.search('mari', self.backend)), set(['user0', 'user1', 'user2']))
+        self.assertEqual(set(self.search('anna maria', self.backend)), set(['user0', 'user2']))
+        self.assertEqual(self.search('marianne', self.backend), ['user2'])
+        self.assertEqual([(lookup.key, lookup.indexed) for lookup in self.grid.plan], [('first_name__fts5', True)])
+
+    def test_rank(self):
+        # index is kept up to date by triggers
+        User.objects.filter(username = 'user3').update(first_name = 'Maria Maria')
+        ranked = self.search('maria', self.backend, keyset = True)
+        self.assertEqual(ranked[0], 'user3')
+        self.assertEqual(set(ranked), set(['user0', 'user1', 'user2', 'user3']))
+        # relevance can not be sought by cursor
+        self.assertTrue(self.grid.keyset_field() is None)
+        self.assertFalse('cursor' in self.grid.result)
+
+
+class WindowTest(TestCase):
+    def setUp(self):
+        for i in range(20):
+            User.objects.create(username = 'user%02d' % i)
+
+    def get_data(self, page, npage, cursor = None, keyset = True):
+        post = {'_page':str(page), '_rows':'3', '_npage':str(npage), '_sidx':'username', '_sord':'desc'}
+        if cursor:
+            post['_cursor'] = cursor
+        grid = Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username'],
+                    post = post,
+                    model = User,
+                    model_name = 'user',
+                    inline = False,
+                    readonly = True,
+                    description = {'user':{'pagination':'keyset'} if keyset else {}})
+        data = grid.get_data()
+        return data, [row['cell'][1] for row in data['rows']]
+
+    def test_window_of_pages(self):
+        data, names = self.get_data(2, 3, keyset = False)
+        self.assertEqual(names, ['user%02d' % i for i in range(3, 12)])
+        self.assertEqual((data['page'], data['total'], data['records']), (2, 7, 20))
+        data, names = self.get_data(6, 3, keyset = False)
+        self.assertEqual(names, ['user15', 'user16', 'user17', 'user18', 'user19'])
+
+    def test_window_is_limited(self):
+        post = {'_page':'1', '_rows':'1', '_npage':'100', '_sidx':'username', '_sord':'desc'}
+        grid = Grid(queryset = User.objects.all(), fields = ['id', 'username'], post = post, model = User, readonly = True)
+        self.assertEqual(len(grid.get_data()['rows']), Grid.MAX_WINDOW_PAGES)
+        post['_npage'] = ''
+        self.assertEqual(Grid(queryset = User.objects.all(), fields = ['id'], post = post, model = User).npage, 1)
+        post['_npage'] = 'x'
+        self.assertRaises(ImproperlyConfigured, Grid, queryset = User.objects.all(), fields = ['id'], post = post, model = User)
+
+    def test_neighbour_windows_follow_cursor(self):
+        data, names = self.get_data(1, 2)
+        self.assertEqual(names, ['user%02d' % i for i in range(0, 6)])
+        # next window starts after last row of previous one
+        data, names = self.get_data(3, 2, data['cursor'])
+        self.assertEqual(names, ['user%02d' % i for i in range(6, 12)])
+        # previous window ends before its first row
+        data, names = self.get_data(1, 2, data['cursor'])
+        self.assertEqual(names, ['user%02d' % i for i in range(0, 6)])
+
+
+class ProjectionTest(TestCase):
+    def get_grid(self, **description):
+        return Grid(queryset = Permission.objects.filter(content_type__app_label = 'auth'),
+                    fields = ['id', 'codename', 'content_type'],
+                    post = {'_page':'1', '_rows':'100', '_sidx':'id', '_sord':'desc'},
+                    model = Permission,
+                    model_name = 'permission',
+                    inline = False,
+                    readonly = True,
+                    description = {'permission':description})
+
+    def expected(self, display):
+        return [[permission.id, permission.codename, display(permission.content_type)]
+                for permission in Permission.objects.filter(content_type__app_label = 'auth').order_by('id')]
+
+    def test_values_of_displayed_columns(self):
+        grid = self.get_grid(display = {'content_type':'model'})
+        # count with totals and page rows, related column is joined
+        with self.assertNumQueries(2):
+            data = grid.get_data()
+        self.assertEqual(grid.column_plan.values, ['id', 'id', 'codename', 'content_type__model'])
+        self.assertEqual([row['cell'] for row in data['rows']], self.expected(lambda content_type: content_type.model))
+
+    def test_instances(self):
+        for description in ({}, {'display':{'content_type':'model'}, 'projection':False}):
+            grid = self.get_grid(**description)
+            with self.assertNumQueries(2):
+                data = grid.get_data()
+            self.assertTrue(grid.column_plan.values is None)
+            # not displayed columns are deferred
+            instance = grid.queryset[0]
+            self.assertEqual(('codename' in instance.__dict__, 'name' in instance.__dict__), (True, False))
+        self.assertEqual([row['cell'] for row in data['rows']], self.expected(lambda content_type: content_type.model))
+        data = self.get_grid().get_data()
+        self.assertEqual([row['cell'] for row in data['rows']], self.expected(unicode))
+
+
+class SerializerTest(ResourceTestCase):
+    def get_resource(self, serializer):
+        class Resource(UserResource):
+            class Meta:
+                register = [['auth','user']]
+                description = {'user':{'fields':['id', 'username']}}
+                readonly = True
+                inline = False
+        Resource._meta.serializer = serializer
+        return Resource()
+
+    def listview(self, resource, **params):
+        params.update({'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc'})
+        return resource.listview(self.request('post', params), 'jqgrid-admin', 'auth', 'user')
+
+    def test_compact_rows(self):
+        resource = self.get_resource(JSONSerializer(compact = True))
+        response = self.listview(resource)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        # compact rows start with primary key
+        self.assertEqual(simplejson.loads(response.content)['rows'], [[self.admin.pk, self.admin.pk, 'admin']])
+        # separators without spaces
+        self.assertTrue('"rows":[[%d,%d,"admin"]]' % (self.admin.pk, self.admin.pk) in response.content)
+        structure = simplejson.loads(resource.listview(self.request('get', {'initial':'1'}), 'jqgrid-admin', 'auth', 'user').content)
+        self.assertEqual(structure['jsonReader'], {'repeatitems':True, 'cell':'', 'id':'0'})
+        self.assertEqual(structure['colModel'][0]['name'], 'idprimarykey')
+
+    def test_object_rows(self):
+        resource = self.get_resource(JSONSerializer())
+        data = simplejson.loads(self.listview(resource).content)
+        self.assertEqual(data['rows'], [{'id':self.admin.pk, 'cell':[self.admin.pk, 'admin']}])
+
+    def test_encoding(self):
+        content = JSONSerializer().dumps({'total':Decimal('1.50'), 'day':date(2012, 1, 2), 'rows':[]})
+        self.assertEqual(simplejson.loads(content), {'total':'1.50', 'day':'2012-01-02', 'rows':[]})
+
+
+class ActionUrlTest(ResourceTestCase):
+    def get_resource(self, client_actions):
+        class Resource(UserResource):
+            class Meta:
+                register = [['auth','user']]
+                description = {'user':{'fields':['id', 'username']}}
+                inline = False
+        Resource._meta.client_actions = client_actions
+        return Resource()
+
+    def listview(self, resource, **params):
+        request = self.request('post', dict(params, _page = '1', _rows = '10', _sidx = 'id', _sord = 'desc'))
+        return simplejson.loads(resource.listview(request, 'jqgrid-admin', 'auth', 'user').content)
+
+    def test_url_template(self):
+        template = Grid.get_action_url_template('jqgrid-admin', 'auth', 'user')
+        self.assertEqual(template, '/jqgrid-admin/auth/user/%s/%s/' % (Grid.PK_PLACEHOLDER, Grid.ACTION_PLACEHOLDER))
+        self.assertEqual(Grid.action_url_templates[('jqgrid-admin', 'auth', 'user')], template)
+        grid = Grid(queryset = User.objects.all(), fields = ['id'], model = User, app_label = 'auth', model_name = 'user',
+                    post = {'_page':'1', '_rows':'10', '_sidx':'', '_sord':'desc'})
+        self.assertEqual(grid.get_edit_url('a b', 'auth', 'user'), '/jqgrid-admin/auth/user/a%20b/edit/')
+        self.assertEqual(grid.get_delete_url(5, 'auth', 'user'), '/jqgrid-admin/auth/user/5/delete/')
+
+    def test_server_links(self):
+        row = self.listview(self.get_resource(False))['rows'][0]
+        self.assertEqual(row['cell'][:2], [self.admin.pk, 'admin'])
+        self.assertTrue('href="/jqgrid-admin/auth/user/%d/edit/"' % self.admin.pk in row['cell'][2])
+
+    def test_client_links(self):
+        resource = self.get_resource(True)
+        # rows end with primary key, links are made by formatter
+        self.assertEqual(self.listview(resource)['rows'][0]['cell'], [self.admin.pk, 'admin', self.admin.pk])
+        structure = simplejson.loads(resource.listview(self.request('get', {'initial':'1'}), 'jqgrid-admin', 'auth', 'user').content)
+        actions = structure['colModel'][-1]
+        self.assertEqual((actions['name'], actions['formatter']), ('actions', 'action_links'))
+        self.assertEqual(actions['formatoptions'], {'url':Grid.get_action_url_template('jqgrid-admin', 'auth', 'user'),
+                                                    'pk':Grid.PK_PLACEHOLDER,
+                                                    'action':Grid.ACTION_PLACEHOLDER})
+
+
+class UserForm(forms.ModelForm):
+    class Meta:
+        model = User
+        fields = ['username']
+
+
+class FormClassTest(ResourceTestCase):
+    def test_classes_are_made_once(self):
+        resource = UserResource()
+        form_class = resource.get_form_class('auth', 'user')
+        self.assertTrue(resource.get_form_class('auth', 'user') is form_class)
+        self.assertTrue('password' in form_class.base_fields)
+        # field class is set by callback of edit dialog form
+        self.assertEqual(form_class.base_fields['username'].widget.attrs['class'], 'CharField')
+        inline_class = resource.get_inline_form_class('auth', 'user')
+        self.assertTrue(resource.get_inline_form_class('auth', 'user') is inline_class)
+        self.assertEqual(inline_class._meta.fields, ['username', 'first_name', 'is_active', 'date_joined'])
+        self.assertTrue(resource.get_form_class('auth', 'group') is not form_class)
+
+    def test_directive_forms(self):
+        resource = UserResource()
+        resource._meta.description = {'user':{'form':UserForm, 'inline_form':UserForm}}
+        try:
+            self.assertTrue(resource.get_form_class('auth', 'user') is UserForm)
+            self.assertTrue(resource.get_inline_form_class('auth', 'user') is UserForm)
+        finally:
+            del resource._meta.description
+
+    def test_inline_save(self):
+        user = User.objects.create(username = 'user', first_name = 'First', date_joined = datetime(2012, 1, 1, 12, 0))
+        request = self.request('post', {'idprimarykey':user.pk, 'username':'renamed', 'first_name':'Second',
+                                        'is_active':'on', 'date_joined':'2012-01-02 12:00'})
+        response = UserResource().inline(request, 'jqgrid-admin', 'auth', 'user')
+        self.assertEqual(simplejson.loads(response.content), {'status':'ok'})
+        user = User.objects.get(pk = user.pk)
+        self.assertEqual((user.username, user.first_name, user.date_joined), ('renamed', 'Second', datetime(2012, 1, 2, 12, 0)))
+
+
+class BenchmarkTest(TestCase):
+    """
+    benchmark configures its own settings, so it runs in other process
+    """
+    def run_benchmark(self, *args):
+        env = dict(os.environ, PYTHONPATH = os.pathsep.join(sys.path))
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        process = subprocess.Popen([sys.executable, '-m', 'djgrid.benchmark.run', '--rows', '200', '--repeat', '1']+list(args),
+                                   stdout = subprocess.PIPE, stderr = subprocess.STDOUT, env = env)
+        output = process.communicate()[0]
+        return process.returncode, output
+
+    def test_regressions(self):
+        directory = tempfile.mkdtemp()
+        baseline = os.path.join(directory, 'gridbench.json')
+        try:
+            status, output = self.run_benchmark('--baseline', baseline, 'narrow', 'totals')
+            self.assertEqual(status, 0, output)
+            with open(baseline) as f:
+                saved = simplejson.load(f)
+            self.assertEqual((saved['rows'], sorted(saved['scenarios'])), (200, ['narrow', 'totals']))
+            self.assertEqual(saved['scenarios']['narrow']['rows'], 50)
+            # every run is slower than threshold below -100 percents
+            status, output = self.run_benchmark('--baseline', baseline, '--no-save', '--threshold', '-100', 'narrow')
+            self.assertEqual(status, 1, output)
+            self.assertTrue('regressions: narrow' in output)
+            status, output = self.run_benchmark('--baseline', baseline, 'missing')
+            self.assertEqual(status, 2)
+        finally:
+            shutil.rmtree(directory)
+
+
+class CollectingSink(Sink):
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, name, metrics, request, response):
+        self.emitted.append((name, metrics))
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class InstrumentationTest(ResourceTestCase):
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.sink = CollectingSink()
+        self.handler = CollectingHandler()
+        self.logger = logging.getLogger('djgrid.instrumentation')
+        self.level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.handler)
+        class Resource(UserResource):
+            class Meta:
+                register = [['auth','user']]
+                description = UserResource._meta.description
+                instrumentation = [self.sink, LoggingSink(), ServerTimingSink()]
+                timing_payload = True
+        self.resource = Resource()
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+
+    def listview(self, user = None):
+        request = self.request('post', {'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc'})
+        if user is not None:
+            request.user = user
+        return self.resource.listview(request, 'jqgrid-admin', 'auth', 'user')
+
+    def test_sinks(self):
+        queries = len(connection.queries)
+        response = self.listview()
+        name, metrics = self.sink.emitted[0]
+        self.assertEqual(name, 'auth.user')
+        self.assertEqual([stage['name'] for stage in metrics['stages']],
+                         ['filter', 'order', 'aggregate', 'project', 'paginate', 'fetch', 'rows', 'serialize'])
+        stages = dict((stage['name'], stage) for stage in metrics['stages'])
+        self.assertEqual((stages['aggregate']['queries'], stages['fetch']['queries'], stages['fetch']['rows']), (1, 1, 1))
+        self.assertEqual(metrics['queries'], 2)
+        self.assertTrue(response['Server-Timing'].startswith('filter;desc="0 queries";dur='))
+        self.assertTrue('total;dur=' in response['Server-Timing'])
+        self.assertEqual(self.handler.records[0].grid_metrics, metrics)
+        self.assertTrue(self.handler.records[0].getMessage().startswith('grid auth.user'))
+        # queries logged by debug cursor are dropped when DEBUG is off
+        self.assertEqual(len(connection.queries), queries)
+
+    def test_timing_payload(self):
+        data = simplejson.loads(self.listview().content)
+        self.assertEqual(data['timing']['queries'], 2)
+        # timing is shown only to staff
+        self.admin.is_staff = False
+        self.assertFalse('timing' in simplejson.loads(self.listview(self.admin).content))
+
+    def test_statements_of_stages(self):
+        grid = Grid(queryset = User.objects.all(), fields = ['id', 'username'], model = User, readonly = True, instrument = True,
+                    post = {'_page':'1', '_rows':'10', '_sidx':'', '_sord':'desc'})
+        grid.get_data()
+        stages = dict((stage.name, stage) for stage in grid.instrument.stages)
+        self.assertEqual(len(stages['fetch'].statements), 1)
+        self.assertTrue(stages['fetch'].statements[0][0].startswith('SELECT'))
+        # without instrument only durations are recorded
+        grid = Grid(queryset = User.objects.all(), fields = ['id', 'username'], model = User, readonly = True,
+                    post = {'_page':'1', '_rows':'10', '_sidx':'', '_sord':'desc'})
+        grid.get_data()
+        self.assertEqual(grid.instrument.as_dict()['queries'], 0)
+
+
+class SlowLogTest(ResourceTestCase):
+    def get_resource(self, slow_log):
+        class Resource(UserResource):
+            class Meta:
+                register = [['auth','user']]
+                description = UserResource._meta.description
+        Resource._meta.slow_log = slow_log
+        return Resource()
+
+    def listview(self, resource, **params):
+        post = {'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc', 'csrfmiddlewaretoken':'secret'}
+        post.update(params)
+        return resource.listview(self.request('post', post), 'jqgrid-admin', 'auth', 'user')
+
+    def test_slow_requests_are_logged(self):
+        resource = self.get_resource(SlowGridLog(threshold = 0, size = 2))
+        self.listview(resource, _search = 'true', username = 'adm')
+        entry = resource._meta.slow_log.get_entries()[0]
+        self.assertEqual((entry['grid'], entry['user']), ('auth.user', 'admin'))
+        # csrf token of other users is not shown
+        self.assertEqual(entry['params'], {'_page':'1', '_rows':'10', '_sidx':'id', '_sord':'desc', '_search':'true', 'username':'adm'})
+        self.assertEqual([statement['stage'] for statement in entry['statements']], ['aggregate', 'fetch'])
+        fetch = entry['statements'][1]
+        self.assertEqual(fetch['params'], [u'adm%'])
+        # explaining would commit transaction of test case on sqlite
+        if connection.vendor=='sqlite':
+            self.assertEqual(fetch['plan'], ['EXPLAIN skipped in managed transaction'])
+        else:
+            self.assertTrue(fetch['plan'])
+        # buffer keeps the latest entries
+        for i in range(3):
+            self.listview(resource, _page = str(i+2))
+        self.assertEqual([entry['params']['_page'] for entry in resource._meta.slow_log.get_entries()], ['4', '3'])
+
+    def test_fast_requests_are_not_logged(self):
+        resource = self.get_resource(SlowGridLog(threshold = 60000, explain = False))
+        self.listview(resource)
+        self.assertEqual(resource._meta.slow_log.get_entries(), [])
+
+    def test_view(self):
+        resource = self.get_resource(SlowGridLog(threshold = 0, explain = False))
+        self.listview(resource)
+        entries = simplejson.loads(resource.slowlogview(self.request('get'), 'jqgrid-admin').content)
+        self.assertEqual(len(entries), 1)
+        self.assertFalse('plan' in entries[0]['statements'][0])
+        self.assertRaises(Http404, self.get_resource(None).slowlogview, self.request('get'), 'jqgrid-admin')
+
+
+class ParallelMixin(object):
+    def create_users(self):
+        for i in range(7):
+            User.objects.create(username = 'user%d' % i, is_active = i%2==0)
+
+    def get_data(self, page, parallel, **post):
+        post.update({'_page':str(page), '_rows':'3', '_sidx':'username', '_sord':'desc'})
+        grid = Grid(queryset = User.objects.all(),
+                    fields = ['id', 'username', 'is_active'],
+                    post = post,
+                    model = User,
+                    model_name = 'user',
+                    readonly = True,
+                    parallel = parallel,
+                    description = {'user':{'totals':{'id':'max'}}})
+        return grid, grid.get_data()
+
+    def assertSameData(self, page, **post):
+        grid, data = self.get_data(page, True, **post)
+        self.assertEqual(data, self.get_data(page, False, **post)[1])
+        return grid, data
+
+
+class SerialQueriesTest(ParallelMixin, TestCase):
+    def setUp(self):
+        self.create_users()
+
+    @unittest.skipUnless(connection.vendor=='sqlite', 'database is not SQLite')
+    def test_sqlite_runs_serially(self):
+        # every sqlite connection to in-memory database has its own one
+        grid, data = self.assertSameData(2)
+        self.assertFalse(grid.is_parallel())
+        self.assertEqual([stage.name for stage in grid.instrument.stages], ['filter', 'order', 'aggregate', 'project', 'paginate', 'fetch', 'rows'])
 
-from django.test import TestCase
 
+@unittest.skipIf(connection.vendor=='sqlite', 'SQLite runs grid queries serially')
+class ParallelQueriesTest(ParallelMixin, TransactionTestCase):
+    """
+    counting thread has its own connection, so data must be committed
+    """
+    def setUp(self):
+        self.create_users()
 
-class SimpleTest(TestCase):
-    def test_basic_addition(self):
-        """
-        Tests that 1 + 1 always equals 2.
-        """
-        self.assertEqual(1 + 1, 2)
+    def test_same_data(self):
+        grid, data = self.assertSameData(2)
+        self.assertTrue(grid.is_parallel())
+        self.assertTrue('parallel' in [stage.name for stage in grid.instrument.stages])
+        self.assertEqual((data['records'], data['userdata']['id']), (7, float(User.objects.order_by('-pk')[0].pk)))
+        self.assertSameData(1, _search = 'true', is_active = 'true')
+        # window past the last page is fetched again
+        grid, data = self.assertSameData(9)
+        self.assertEqual((data['page'], len(data['rows'])), (3, 1))